@@ -0,0 +1,206 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from db_utils import batch_insert, batch_upsert, read_table  # noqa: E402
+from elo_engine import (  # noqa: E402
+    build_result_frames, index_fighters, initial_ratings, k_factors, parse_fighter_ids, run_fights, run_fights_batched,
+    to_days
+)
+from event_parser import parse_event_page  # noqa: E402
+from get_links import listing_url, parse_listing  # noqa: E402
+from rating_history import RatingHistory  # noqa: E402
+from scrape_ufc_ranks import parse_ufc_rankings  # noqa: E402
+from storage import SQLiteClient  # noqa: E402
+from synthetic import generate_fights  # noqa: E402
+
+# Offline benchmarks for the scrapers' parsers, the Elo stage, rating history lookups and the storage helpers.
+# Everything runs on the saved pages in benchmarks/fixtures, synthetic fight histories and
+# the local SQLite backend, no network or Supabase.
+#
+#   python benchmarks/run_benchmarks.py
+#   python benchmarks/run_benchmarks.py --scales 10000,100000 --seconds 1
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+EVENT_PAGES = [
+    'sherdog_event_full.html',
+    'sherdog_event_main_only.html',
+    'sherdog_event_yet_to_come.html',
+    'sherdog_event_no_fights.html',
+    'sherdog_event_no_date.html',
+    'sherdog_event_empty.html',
+]
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def time_pages(parse, pages, min_seconds):
+    # runs parse over the pages until min_seconds have passed, returns pages/sec
+    done = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while True:
+            for name, html in pages:
+                parse(html, name)
+            done += len(pages)
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_seconds:
+                return done / elapsed
+
+
+def bench_parsers(min_seconds):
+    # keyed by the listing urls, the first page is parsed as the main events page
+    listing = [(listing_url(page), read_fixture(name))
+               for page, name in [(1, 'sherdog_events.html'), (2, 'sherdog_events_page2.html')]]
+    events = [(name, read_fixture(name)) for name in EVENT_PAGES]
+    rankings = [('ufc_rankings.html', read_fixture('ufc_rankings.html'))]
+
+    results = [
+        ('get_links listing (parse_listing)', time_pages(parse_listing, listing, min_seconds)),
+        ('get_fights event page (all fixtures)', time_pages(parse_event_page, events, min_seconds)),
+        ('get_fights event page (full card)', time_pages(parse_event_page, events[:1], min_seconds)),
+        ('scrape_ufc_rankings', time_pages(lambda html, name: parse_ufc_rankings(html), rankings, min_seconds)),
+    ]
+    print("\n--- Parsers ---")
+    for label, pages_per_sec in results:
+        print(f"  {label:<42} {pages_per_sec:10.1f} pages/sec")
+
+
+def run_elo(fights_df, engine=run_fights):
+    # the calculate_elo.py fight stage, starting every fighter from 1200
+    fights_df = fights_df.assign(winner_id=parse_fighter_ids(fights_df['winner_id']).astype('int64'),
+                                 loser_id=parse_fighter_ids(fights_df['loser_id']).astype('int64'))
+    _, winner_idx, loser_idx, fighter_ids = index_fighters([], fights_df['winner_id'], fights_df['loser_id'])
+    ratings = initial_ratings(len(fighter_ids), [], [])
+    is_ko_or_sub = fights_df['dom'].isin(['ko', 'sub']).to_numpy()
+    is_round_one = (fights_df['round'].astype(str) == '1').to_numpy()
+    elo_columns = engine(winner_idx, loser_idx, k_factors(is_ko_or_sub, is_round_one), ratings)
+    return build_result_frames(fights_df, elo_columns)
+
+
+def bench_elo(scales):
+    print("\n--- Elo update ---")
+    for n_fights in scales:
+        fights_df = generate_fights(n_fights)
+        fights_df['event_date'] = pd.to_datetime(fights_df['event_date'])
+
+        for label, engine in [('sequential', run_fights), ('card', run_fights_batched)]:
+            start = time.perf_counter()
+            run_elo(fights_df, engine)
+            elapsed = time.perf_counter() - start
+
+            # tracing slows the loop down a lot, so memory is measured on a separate run
+            tracemalloc.start()
+            run_elo(fights_df, engine)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(f"  {n_fights:>9} fights  {label:<10} {n_fights / elapsed:12.0f} fights/sec  "
+                  f"{elapsed:7.2f}s  peak {peak / 1024 / 1024:8.1f} MiB")
+
+
+def bench_history(scales, n_queries=100000):
+    # building the point-in-time index and answering as-of queries against it
+    print("\n--- Rating history ---")
+    rng = np.random.default_rng(0)
+    for n_fights in scales:
+        fights_df = generate_fights(n_fights)
+        fights_df['winner_id'] = parse_fighter_ids(fights_df['winner_id']).astype('int64')
+        fights_df['loser_id'] = parse_fighter_ids(fights_df['loser_id']).astype('int64')
+        _, winner_idx, loser_idx, fighter_ids = index_fighters([], fights_df['winner_id'], fights_df['loser_id'])
+        is_ko_or_sub = fights_df['dom'].isin(['ko', 'sub']).to_numpy()
+        is_round_one = (fights_df['round'].astype(str) == '1').to_numpy()
+        elo_columns = run_fights_batched(winner_idx, loser_idx, k_factors(is_ko_or_sub, is_round_one),
+                                         initial_ratings(len(fighter_ids), [], []))
+        days = to_days(fights_df['event_date'])
+
+        start = time.perf_counter()
+        history = RatingHistory.from_fights(fights_df['winner_id'].to_numpy(), fights_df['loser_id'].to_numpy(),
+                                            days, elo_columns)
+        build = time.perf_counter() - start
+
+        pick = rng.integers(0, n_fights, n_queries)
+        query_ids = fights_df['winner_id'].to_numpy()[pick]
+        query_dates = pd.to_datetime(fights_df['event_date'].to_numpy()[pick])
+        start = time.perf_counter()
+        history.lookup(query_ids, query_dates, before=True)
+        batched = time.perf_counter() - start
+
+        n_single = min(n_queries, 10000)
+        start = time.perf_counter()
+        for fighter_id, date in zip(query_ids[:n_single], query_dates[:n_single]):
+            history.rating_at(fighter_id, date, before=True)
+        single = time.perf_counter() - start
+
+        print(f"  {n_fights:>9} fights  build {build:7.2f}s  batched {n_queries / batched:12.0f} lookups/sec  "
+              f"single {n_single / single:10.0f} lookups/sec")
+
+
+def bench_storage(n_rows):
+    # batch writes and keyset reads against the local SQLite backend
+    print("\n--- Storage (sqlite) ---")
+    frames = run_elo(generate_fights(n_rows))
+    raw_records = frames['normal'].drop(columns=['id']).to_dict(orient='records')
+    fighter_records = [
+        {'fighter_id': int(fid), 'name': f'Fighter {fid}', 'current_elo': 1200.0, 'current_elo_dom': 1200.0}
+        for fid in frames['normal']['winner_id'].unique()
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = SQLiteClient(os.path.join(tmp, 'bench.sqlite'))
+        steps = [
+            ('batch_insert fighters_regular_raw', len(raw_records),
+             lambda: batch_insert(client, 'fighters_regular_raw', raw_records)),
+            ('read_table fighters_regular_raw', len(raw_records),
+             lambda: read_table(client, 'fighters_regular_raw', '*', key='id')),
+            ('batch_upsert fighters_enriched_new (insert)', len(fighter_records),
+             lambda: batch_upsert(client, 'fighters_enriched_new', fighter_records, on_conflict='fighter_id')),
+            ('batch_upsert fighters_enriched_new (update)', len(fighter_records),
+             lambda: batch_upsert(client, 'fighters_enriched_new', fighter_records, on_conflict='fighter_id')),
+        ]
+        for label, n, step in steps:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                step()
+            elapsed = time.perf_counter() - start
+            print(f"  {label:<42} {n / elapsed:10.0f} rows/sec  ({n} rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline parser and Elo benchmarks.")
+    parser.add_argument('--scales', default='10000,100000,1000000',
+                        help="comma separated synthetic history sizes for the Elo benchmark")
+    parser.add_argument('--seconds', type=float, default=2.0,
+                        help="minimum time spent on each parser benchmark")
+    parser.add_argument('--storage-rows', type=int, default=100000,
+                        help="rows written and read in the storage benchmark")
+    parser.add_argument('--only', choices=['parsers', 'elo', 'history', 'storage'])
+    args = parser.parse_args()
+
+    if args.only in (None, 'parsers'):
+        bench_parsers(args.seconds)
+    if args.only in (None, 'elo'):
+        bench_elo([int(n) for n in args.scales.split(',') if n])
+    if args.only in (None, 'history'):
+        bench_history([int(n) for n in args.scales.split(',') if n])
+    if args.only in (None, 'storage'):
+        bench_storage(args.storage_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+WINBY = ['KO (Punches)', 'TKO (Elbows)', 'Submission (Rear-Naked Choke)', 'Decision (Unanimous)',
+         'Decision (Split)', 'TKO (Doctor Stoppage)', 'Submission (Armbar)']
+REFEREES = ['Herb Dean', 'Marc Goddard', 'Jason Herzog', 'Mike Beltran', None]
+
+
+def generate_fights(n_fights, n_fighters=None, seed=0, start='1993-11-12', events_per_week=3):
+    # a fight history shaped like mma_fight_results (plus 'dom'), sorted by event_date.
+    # fighter activity is skewed so a minority of fighters has long records, like the real data.
+    rng = np.random.default_rng(seed)
+    if n_fighters is None:
+        n_fighters = max(2, n_fights // 4)
+
+    weights = rng.pareto(1.5, n_fighters) + 1
+    weights /= weights.sum()
+    winner = rng.choice(n_fighters, n_fights, p=weights)
+    loser = rng.choice(n_fighters, n_fights, p=weights)
+    clash = winner == loser
+    loser[clash] = (loser[clash] + 1) % n_fighters
+
+    fights_per_event = 10
+    event_no = np.arange(n_fights) // fights_per_event
+    days = (event_no * 7) // events_per_week
+    event_date = pd.Timestamp(start) + pd.to_timedelta(days, unit='D')
+
+    fighter_ids = rng.choice(np.arange(1000, 1000 + n_fighters * 20), n_fighters, replace=False)
+    winby = np.array(WINBY, dtype=object)[rng.integers(0, len(WINBY), n_fights)]
+    fights_df = pd.DataFrame({
+        'id': np.arange(1, n_fights + 1),
+        'winner_id': fighter_ids[winner].astype(str),
+        'winner_name': np.char.add('Fighter ', fighter_ids[winner].astype(str)),
+        'final_result': 'win',
+        'loser_name': np.char.add('Fighter ', fighter_ids[loser].astype(str)),
+        'loser_id': fighter_ids[loser].astype(str),
+        'event_name': np.char.add('Event ', event_no.astype(str)),
+        'event_date': event_date.strftime('%Y-%m-%d'),
+        'winby': winby,
+        'referee': np.array(REFEREES, dtype=object)[rng.integers(0, len(REFEREES), n_fights)],
+        'round': rng.choice(['1', '2', '3', '4', '5'], n_fights, p=[0.35, 0.25, 0.3, 0.05, 0.05]),
+    })
+    fights_df['dom'] = np.select(
+        [fights_df['winby'].str.contains('TKO|KO', case=False, regex=True),
+         fights_df['winby'].str.contains('Submission', case=False, regex=True)],
+        ['ko', 'sub'], default='dec'
+    )
+    return fights_df
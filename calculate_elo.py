@@ -1,119 +1,226 @@
 import pandas as pd
 import numpy as np
 import os
+import resource
 import sys
-from supabase import create_client, Client
 import time
-
-#define batch function
-
-def batch_insert(supabase_table, data, batch_size=10000):
-    total_records = len(data)
-    print(f"Starting batch insert into '{supabase_table}' with {total_records} records.")
-    for i in range(0, total_records, batch_size):
-        batch = data[i:i + batch_size]
-        print(f"Inserting records {i + 1} to {i + len(batch)}...")
-        retries = 3
-        while retries > 0:
-            try:
-                supabase.table(supabase_table).insert(batch).execute()
-                break  # Break the retry loop if successful
-            except Exception as e:
-                retries -= 1
-                print(f"Error inserting records {i + 1} to {i + len(batch)}: {e}")
-                if retries > 0:
-                    print(f"Retrying... ({3 - retries} retries left)")
-                    time.sleep(1)  # Wait a bit before retrying
-                else:
-                    print("Failed to insert batch after retries. Exiting.")
-                    sys.exit(1)
-    print(f"Finished batch insert into '{supabase_table}'.")
-
-
-def batch_delete(table_name, batch_size=1000):
-    deleted_count = 0
-
-    while True:
-        # Always start from offset=0
-        response = supabase.table(table_name) \
-                           .select('id') \
-                           .neq('name', 'unknown') \
-                           .range(0, batch_size - 1) \
-                           .execute()
-
-        data = response.data
-        if not data:
-            break
-
-        chunk_ids = [row['id'] for row in data if 'id' in row]
-
-        if chunk_ids:
-            supabase.table(table_name) \
-                    .delete() \
-                    .in_('id', chunk_ids) \
-                    .execute()
-
-            deleted_count += len(chunk_ids)
-            print(f"Deleted {len(chunk_ids)} records.")
- 
-            time.sleep(0.1)
+from datetime import datetime, timezone
+from storage import get_client
+from db_utils import batch_upsert, diff_rows, read_table, to_records
+from leaderboards import rank_fighters, read_ranks, write_ranks
+from rating_history import RatingHistory, load_rating_history
+from ratings_snapshot import ELO_SNAPSHOT, RATING_COLUMNS, load_snapshot, save_snapshot, table_watermark
+from stages import BackgroundWriter, print_stage_stats
+from elo_engine import (
+    VARIANTS, best_win_frame, build_result_frames, day_strings, index_fighters, initial_best_wins, initial_peaks,
+    initial_ratings, k_factors, last_fight_days, parse_fighter_ids, peak_frame, run_fights, run_fights_batched, to_days,
+    update_best_wins, update_peaks
+)
+
+# ELO_UPDATE_MODE=card rates each event card against the pre-card ratings in vectorized batches,
+# with the fights of a date in id order so results don't depend on row order;
+# sequential (default) is the fight by fight loop in sort order
+ELO_UPDATE_MODE = os.environ.get('ELO_UPDATE_MODE', 'sequential')
+
+# Saved point-in-time rating index (see rating_history.py), extended with every run's fights when set
+RATING_HISTORY_PATH = os.environ.get('RATING_HISTORY_PATH')
+
+# fighters_enriched_new as held in memory: column -> (dtype, fill for missing values, None keeps them missing).
+# Repeated strings are categoricals (columns update_ratings rewrites stay strings), days
+# fit 32 bits; ratings stay float64 so they round-trip exactly
+FIGHTER_SCHEMA = {
+    'fighter_id': ('int64', None),
+    'rn': ('int64', 1),
+    'current_elo': ('float64', 0),
+    'current_elo_dom': ('float64', 0),
+    'peak_elo': ('float64', 0),
+    'peak_elo_dom': ('float64', 0),
+    'peak_date': ('string', None),
+    'peak_date_dom': ('string', None),
+    'days_peak': ('float32', 0),
+    'days_peak_dom': ('float32', 0),
+    'best_win': ('string', 'unknown'),
+    'best_win_dom': ('string', 'unknown'),
+    'best_win_elo': ('float64', None),
+    'best_win_elo_dom': ('float64', None),
+    'last_fight_date': ('string', None),
+    'name': ('string', 'unknown'),
+    'nickname': ('category', 'unknown'),
+    'birth_date': ('category', 'unknown'),
+    'nationality': ('category', 'unknown'),
+    'birthplace': ('category', 'unknown'),
+    'association': ('category', 'unknown'),
+    'weight_class': ('category', 'unknown'),
+    'age': ('category', 'unknown'),
+    'weight': ('category', 'unknown'),
+    'height': ('category', 'unknown'),
+}
+CATEGORY_COLUMNS = [col for col, (dtype, _) in FIGHTER_SCHEMA.items() if dtype == 'category']
+
+
+# Convert to the schema's dtypes in one pass over the columns, with fill=True also filling missing
+# values the way the table stores them; applied to both the fetched rows and the updated rows so
+# they can be compared column by column. Columns outside the schema are passed through
+def normalize_fighters(df, fill=True, verbose=True):
+    missing_cols = [col for col in FIGHTER_SCHEMA if col not in df.columns and col != 'rn']
+    if missing_cols and verbose:
+        print(f"Warning: The following columns are missing in final_df and will be skipped: {missing_cols}")
+
+    columns = {}
+    for col in df.columns:
+        if col == 'id':
+            continue
+        if col not in FIGHTER_SCHEMA:
+            columns[col] = df[col]
+            continue
+
+        dtype, fill_value = FIGHTER_SCHEMA[col]
+        values = df[col]
+        if dtype == 'category':
+            values = values.astype('string').astype('category')
+            if fill and fill_value is not None and values.isnull().any():
+                if fill_value not in values.cat.categories:
+                    values = values.cat.add_categories([fill_value])
+                values = values.fillna(fill_value)
+        elif dtype == 'string':
+            values = values.astype('string')
+            if fill and fill_value is not None:
+                values = values.fillna(fill_value)
         else:
-            break
-
-    print(f"Deleted a total of {deleted_count} records from '{table_name}'.")
-
-
- 
- 
-
-# Define cleanup function
-def clean_fighter_id(fid):
-    if fid is None or fid == '':
-        return None
-    try:
-        fid_int = int(float(fid))
-        return str(fid_int)
-    except (ValueError, TypeError):
-        return None
-
-# Initialize Supabase client
-SUPABASE_URL = os.environ.get('SUPABASE_URL')
-SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            values = pd.to_numeric(values, errors='coerce')
+            if fill and fill_value is not None:
+                values = values.fillna(fill_value)
+            values = values.where(~values.isin([np.inf, -np.inf]))
+            try:
+                values = values.astype(dtype)
+            except (TypeError, ValueError) as e:
+                print(f"  [Error] Converting '{col}' to {dtype} failed: {e}")
+            if dtype == 'int64' and values.isnull().any():
+                raise ValueError(
+                    f"  [Error] Column '{col}' has null values but must be non-nullable (int64)."
+                )
+        columns[col] = values
+    return pd.DataFrame(columns, index=df.index)
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+
+def concat_fighters(frames):
+    # pd.concat only keeps a categorical column when every frame has the same categories
+    frames = [frame for frame in frames if len(frame.columns)]
+    for col in CATEGORY_COLUMNS:
+        if all(col in frame.columns and isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = frames[0][col].cat.categories
+            for frame in frames[1:]:
+                categories = categories.union(frame[col].cat.categories)
+            frames = [frame.assign(**{col: frame[col].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+def print_sample_values(df):
+    if df.empty:
+        print("final_df is empty, cannot display sample values.")
+    else:
+        for col in df.columns:
+            col_type = df[col].dtype
+            sample_value = df[col].iloc[0]
+            print(f"  Column: {col}, dtype: {col_type}, example: {repr(sample_value)}")
+
+def load_new_fights(supabase):
+    # Scraped in previous script. mma_fight_results keeps its rows between crawls, update_ratings
+    # stamps rated_at on the fights it rated so only new ones are read
+    fights_df = read_table(supabase, 'mma_fight_results', '*', key='id',
+                           where=lambda query: query.is_('rated_at', 'null'))
+    new_fights_df = drop_rated_fights(supabase, fights_df)
+    if len(new_fights_df) < len(fights_df):
+        # rated by a run that stopped before stamping them, or by the crawl-and-rate runs from before rated_at
+        mark_rated(supabase, fights_df.loc[~fights_df['id'].isin(new_fights_df['id']), 'id'])
+    return new_fights_df
+
+def mark_rated(supabase, fight_ids, chunk_size=200):
+    # stamped by row id, rows from before fight keys included
+    ids = pd.Series(fight_ids).dropna().astype('int64').unique().tolist()
+    rated_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    for i in range(0, len(ids), chunk_size):
+        supabase.table('mma_fight_results').update({'rated_at': rated_at}).in_('id', ids[i:i + chunk_size]).execute()
+
+def drop_rated_fights(supabase, fights_df, chunk_size=200):
+    # fights already in the raw results were rated by an earlier run: matched on fight_key, and rows
+    # without one (written before fight keys) on winner, loser and event date
+    raw_table = VARIANTS['normal']['raw_table']
+    fight_keys = fights_df['fight_key'] if 'fight_key' in fights_df.columns else pd.Series(None, index=fights_df.index)
+    keyed = fight_keys.notnull()
+
+    keys = fight_keys[keyed].unique().tolist()
+    rated_keys = set()
+    for i in range(0, len(keys), chunk_size):
+        response = supabase.table(raw_table).select('fight_key').in_('fight_key', keys[i:i + chunk_size]).execute()
+        rated_keys.update(row['fight_key'] for row in response.data)
+    rated = keyed & fight_keys.isin(rated_keys)
+
+    legacy_df = fights_df[~keyed]
+    winner_ids = parse_fighter_ids(legacy_df['winner_id']).dropna().astype('int64').astype(str).unique().tolist()
+    raw_fights = set()
+    for i in range(0, len(winner_ids), chunk_size):
+        response = supabase.table(raw_table).select('winner_id, loser_id, event_date').in_(
+            'winner_id', winner_ids[i:i + chunk_size]
+        ).execute()
+        raw_df = pd.DataFrame(response.data, columns=['winner_id', 'loser_id', 'event_date'])
+        raw_fights.update(zip(parse_fighter_ids(raw_df['winner_id']), parse_fighter_ids(raw_df['loser_id']),
+                              to_days(raw_df['event_date'])))
+    if raw_fights:
+        legacy = zip(parse_fighter_ids(legacy_df['winner_id']), parse_fighter_ids(legacy_df['loser_id']),
+                     to_days(legacy_df['event_date']))
+        rated[~keyed] = [fight in raw_fights for fight in legacy]
+
+    if rated.any():
+        print(f"Skipping {int(rated.sum())} fights that are already rated.")
+    return fights_df[~rated.to_numpy()].reset_index(drop=True)
+
+def update_rating_history(supabase, new_fights_df, fight_days, elo_columns):
+    # extend the saved index with this run's fights, or build it from the raw tables,
+    # which already hold them, when there is none yet
+    if os.path.exists(RATING_HISTORY_PATH):
+        history = RatingHistory.load(RATING_HISTORY_PATH)
+        history.extend(new_fights_df['winner_id'].to_numpy(), new_fights_df['loser_id'].to_numpy(),
+                       fight_days, elo_columns)
+    else:
+        history = load_rating_history(supabase)
+    history.save(RATING_HISTORY_PATH)
+    print(f"Rating history: {len(history)} points for {len(history.fighter_ids)} fighters")
 
-# Scraped in previous script
-response = supabase.table('mma_fight_results').select('*').execute()
-new_fights_df = pd.DataFrame(response.data)
 
-# Conditions for 'dom'
-conditions = [
-    new_fights_df['winby'].str.contains('TKO|KO', case=False, regex=True, na=False),
-    new_fights_df['winby'].str.contains('Submission', case=False, regex=True, na=False)
-]
+def insert_raw_results(supabase, result_frames):
+    # Insert fight results into Supabase tables, get rid of id columns, let it be handled by Supabase
+    for name, variant in VARIANTS.items():
+        data = result_frames[name].drop(columns=['id'], errors='ignore').to_dict(orient='records')
+        supabase.table(variant['raw_table']).insert(data).execute()
 
-# Outputs
-choices = ['ko', 'sub']
 
-# Apply conditions, create new column 'dom'
-new_fights_df['dom'] = np.select(conditions, choices, default='dec')
+def insert_new_fighters(supabase, new_fighters):
+    supabase.table('new_fighters').insert(
+        [{**new_fighter, 'fighter_id': str(new_fighter['fighter_id'])} for new_fighter in new_fighters]
+    ).execute()
 
-# Previously finished table to update
-records = []
-limit = 50000
-offset = 0
 
-while True:
-  
-    response = supabase.table('fighters_enriched_new').select('''
+def load_fighters(supabase):
+    # fighters_enriched_new, compact and with int64 fighter ids
+    final_df = read_table(supabase, 'fighters_enriched_new', '''
         name,
         peak_elo,
         peak_elo_dom,
+        peak_date,
+        peak_date_dom,
         current_elo,
         current_elo_dom,
         days_peak_dom,
         days_peak,
         best_win_dom,
         best_win,
+        best_win_elo,
+        best_win_elo_dom,
+        last_fight_date,
         nationality,
         birthplace,
         birth_date,
@@ -124,373 +231,295 @@ while True:
         height,
         nickname,
         fighter_id
-    ''').order('fighter_id').range(offset, offset + limit - 1).execute()
-    
-    data = response.data
-    
-    if not data:
-        break
-    
-    records.extend(data)
-    offset += limit
-
-final_df = pd.DataFrame(records)
-
-print("Total rows:", len(final_df))
-print("Unique fighter_ids:", final_df['fighter_id'].nunique())
-
-# Look at the top 10 repeated IDs:
-print("\n-- Top repeated fighter IDs --")
-print(final_df['fighter_id'].value_counts().head(10))
-
-
-
-print(f"Fetched {len(final_df)} rows from fighters_enriched_new.")
-print(f"Number of fighters in final_df right after creation: {final_df['fighter_id'].nunique()}")
-
-# Apply the cleaning function to fighter IDs
-final_df['fighter_id'] = final_df['fighter_id'].apply(clean_fighter_id)
-new_fights_df['winner_id'] = new_fights_df['winner_id'].apply(clean_fighter_id)
-new_fights_df['loser_id'] = new_fights_df['loser_id'].apply(clean_fighter_id)
-
-# Ensure there are no None or NaN fighter_ids
-final_df = final_df[final_df['fighter_id'].notnull()]
-new_fights_df = new_fights_df[new_fights_df['winner_id'].notnull()]
-new_fights_df = new_fights_df[new_fights_df['loser_id'].notnull()]
-
-# Check for duplicates in final_df before any processing  ->>> Temorarily not checking for duplication cause I think it sucks
-# initial_duplicates = final_df[final_df['fighter_id'].duplicated(keep=False)]
-
-# if not initial_duplicates.empty:
-#     print("Duplicates found in final_df before processing:")
-#     print(initial_duplicates)
-#     # Drop duplicates, keeping the first occurrence
-#     final_df = final_df.drop_duplicates(subset='fighter_id', keep='first')
-#     print("Duplicates have been removed from final_df.")
-
-# Initialize elo dictionaries
-current_elos_normal = {}
-current_elos_dom = {}
-
-# List to collect new fighters
-new_fighters = []
-
-# MATCHING ERROR CHECKING LOGS
-print("\nSample fighter_ids from final_df:")
-print(final_df['fighter_id'].head(5).tolist())
-
-print("\nSample winner_ids from new_fights_df:")
-print(new_fights_df['winner_id'].head(5).tolist())
-
-print("\nSample loser_ids from new_fights_df:")
-print(new_fights_df['loser_id'].head(5).tolist())
-# END MATCHING ERROR CHECKING LOGS
-
-# Map existing fighters to their current elos
-for _, row in final_df.iterrows():
-    fighter_id = row['fighter_id']
-    current_elos_normal[fighter_id] = row['current_elo']
-    current_elos_dom[fighter_id] = row['current_elo_dom']
-
-# Identifying new fighters and assigning elo
-for fighter_id, fighter_name in zip(
-    pd.concat([new_fights_df['winner_id'], new_fights_df['loser_id']]),
-    pd.concat([new_fights_df['winner_name'], new_fights_df['loser_name']])
-):
-    if fighter_id not in current_elos_normal:
-        current_elos_normal[fighter_id] = 1200.0
-        current_elos_dom[fighter_id] = 1200.0
-        new_fighters.append({'fighter_id': fighter_id, 'name': fighter_name})
-
-print(f"Number of fighters in final_df after cleaning: {final_df['fighter_id'].nunique()}")
-print(f"Number of fighters in current_elos_normal: {len(current_elos_normal)}")
-
-# Define elo calculation functions
-def expected_score(elo_a, elo_b):
-    return 1 / (1 + 10 ** ((elo_b - elo_a) / 400))
-
-def update_elo(winner_elo, loser_elo, k_factor, is_ko_or_sub, is_round_one, variation):
-    if variation in ['dom']:
-        if is_ko_or_sub:
-            k_factor *= 2 if is_round_one else 1.5
-    expected_win = expected_score(winner_elo, loser_elo)
-    new_winner_elo = winner_elo + k_factor * (1 - expected_win)
-    new_loser_elo = loser_elo + k_factor * (0 - (1 - expected_win))
-    return round(new_winner_elo, 2), round(new_loser_elo, 2)
-
-# Initialize elo ratings for calculations
-elo_ratings_normal = current_elos_normal.copy()
-elo_ratings_dom = current_elos_dom.copy()
-
-# Initialize lists to store fight results
-results_normal = []
-results_dom = []
-
-# Sort fights by date
-new_fights_df['event_date'] = pd.to_datetime(new_fights_df['event_date'])
-new_fights_df.sort_values('event_date', inplace=True)
-
-# Process each fight
-for _, fight in new_fights_df.iterrows():
-    fight_data = {
-        'id': fight['id'],
-        'winner_id': fight['winner_id'],
-        'winner_name': fight['winner_name'],
-        'loser_id': fight['loser_id'],
-        'loser_name': fight['loser_name'],
-        'event_name': fight['event_name'],
-        'event_date': fight['event_date'],
-        'winby': fight['winby'],
-        'referee': fight['referee'],
-        'round': fight['round'],
-        'dom': fight['dom']
-    }
-    is_ko_or_sub = fight['dom'] in ['ko', 'sub']
-    is_round_one = str(fight['round']) == '1'
-
-    for variation in ['normal', 'dom']:
-        k_factor = 60
-        if variation == 'normal':
-            winner_elo_before = elo_ratings_normal[fight['winner_id']]
-            loser_elo_before = elo_ratings_normal[fight['loser_id']]
-        elif variation == 'dom':
-            winner_elo_before = elo_ratings_dom[fight['winner_id']]
-            loser_elo_before = elo_ratings_dom[fight['loser_id']]
-
-        winner_elo_after, loser_elo_after = update_elo(
-            winner_elo_before, loser_elo_before, k_factor, is_ko_or_sub, is_round_one, variation
-        )
-
-        # Update ELO ratings
-        if variation == 'normal':
-            elo_ratings_normal[fight['winner_id']] = winner_elo_after
-            elo_ratings_normal[fight['loser_id']] = loser_elo_after
-            results_normal.append({**fight_data,
-                                   'winner_elo_before': winner_elo_before,
-                                   'winner_elo_after': winner_elo_after,
-                                   'loser_elo_before': loser_elo_before,
-                                   'loser_elo_after': loser_elo_after})
-        elif variation == 'dom':
-            elo_ratings_dom[fight['winner_id']] = winner_elo_after
-            elo_ratings_dom[fight['loser_id']] = loser_elo_after
-            results_dom.append({**fight_data,
-                                'winner_elo_before': winner_elo_before,
-                                'winner_elo_after': winner_elo_after,
-                                'loser_elo_before': loser_elo_before,
-                                'loser_elo_after': loser_elo_after})
-
-
-df_normal = pd.DataFrame(results_normal)
-df_dom = pd.DataFrame(results_dom)
-
-df_normal['event_date'] = df_normal['event_date'].astype(str)
-df_dom['event_date'] = df_dom['event_date'].astype(str)
-
-# Get rid of id columns, let it be handled by Supabase
-data_normal = df_normal.drop(columns=['id'], errors='ignore').to_dict(orient='records')
-data_dom = df_dom.drop(columns=['id'], errors='ignore').to_dict(orient='records')
-
-# Insert fight results into Supabase tables
-supabase.table('fighters_regular_raw').insert(data_normal).execute()
-supabase.table('fighters_dom_raw').insert(data_dom).execute()
-
-# Create dataframe of new elos
-elo_updates = pd.DataFrame({
-    'fighter_id': list(elo_ratings_normal.keys()),
-    'current_elo': list(elo_ratings_normal.values()),
-    'current_elo_dom': list(elo_ratings_dom.values()),
-})
-
-# Ensure fighter_id is of string type
-final_df['fighter_id'] = final_df['fighter_id'].astype(str)
-elo_updates['fighter_id'] = elo_updates['fighter_id'].astype(str)
-
-# Set fighter_id as the index for both dataframes
-final_df.set_index('fighter_id', inplace=True)
-elo_updates.set_index('fighter_id', inplace=True)
-
-# Update final_df with elo_updates
-final_df.update(elo_updates)
-
-# Reset index to turn fighter_id back into a column
-final_df.reset_index(inplace=True)
-
-# Ensure unique fighter_ids when adding new fighters
-existing_fighter_ids = set(final_df['fighter_id'])
-
-# Filter out any new_fighters that already exist in final_df
-filtered_new_fighters = []
-for new_fighter in new_fighters:
-    fighter_id = new_fighter['fighter_id']
-    if fighter_id not in existing_fighter_ids:
-        # Add missing fields with default values
-        new_fighter.update({
-            'current_elo': current_elos_normal[fighter_id],
-            'peak_elo': current_elos_normal[fighter_id],
-            'current_elo_dom': current_elos_dom[fighter_id],
-            'peak_elo_dom': current_elos_dom[fighter_id],
-            'days_peak': 0,
-            'days_peak_dom': 0,
-            'best_win_dom': 'unknown',
-            'best_win': 'unknown',
-            'nationality': 'unknown',
-            'birthplace': 'unknown',
-            'birth_date': 'unknown',
-            'association': 'unknown',
-            'weight_class': 'unknown',
-            'age': 'unknown',
-            'weight' : 'unknown',
-            'height' : 'unknown',
-            'nickname' : 'unknown'
-        })
-        filtered_new_fighters.append(new_fighter)
+    ''', key='fighter_id', page_size=50000)
+
+    print("Total rows:", len(final_df))
+    print("Unique fighter_ids:", final_df['fighter_id'].nunique())
+
+    # Look at the top 10 repeated IDs:
+    print("\n-- Top repeated fighter IDs --")
+    print(final_df['fighter_id'].value_counts().head(10))
+
+
+
+    print(f"Fetched {len(final_df)} rows from fighters_enriched_new.")
+    print(f"Number of fighters in final_df right after creation: {final_df['fighter_id'].nunique()}")
+
+    # Parse fighter IDs to int64, they stay integers until they are written
+    final_df['fighter_id'] = parse_fighter_ids(final_df['fighter_id'])
+
+    # Ensure there are no None or NaN fighter_ids
+    final_df = final_df[final_df['fighter_id'].notnull()].astype({'fighter_id': 'int64'})
+
+    # Hold the table compactly from here on; missing values are only filled before writing
+    fetched_mb = memory_mb(final_df)
+    final_df = normalize_fighters(final_df, fill=False, verbose=False)
+    print(f"fighters_enriched_new in memory: {fetched_mb:.1f} MiB as fetched, {memory_mb(final_df):.1f} MiB compact")
+    return final_df
+
+def update_ratings(supabase, new_fights_df):
+    # runs the new fights through the elo engine and writes the raw tables and fighters_enriched_new
+    new_fights_df = new_fights_df.copy()
+    # every fight handed in is settled by this run, the ones without usable fighter ids included
+    fight_ids = new_fights_df['id'] if 'id' in new_fights_df.columns else None
+
+    # Conditions for 'dom'
+    conditions = [
+        new_fights_df['winby'].str.contains('TKO|KO', case=False, regex=True, na=False),
+        new_fights_df['winby'].str.contains('Submission', case=False, regex=True, na=False)
+    ]
+
+    # Outputs
+    choices = ['ko', 'sub']
+
+    # Apply conditions, create new column 'dom'
+    new_fights_df['dom'] = np.select(conditions, choices, default='dec')
+
+    # Previously finished table to update, from the local snapshot while it's still current
+    watermark = table_watermark(supabase) if ELO_SNAPSHOT else None
+    snapshot = load_snapshot() if ELO_SNAPSHOT else None
+    from_snapshot = snapshot is not None and snapshot[1]['watermark'] == watermark
+    if from_snapshot:
+        final_df = snapshot[0]
+        print(f"Loaded {len(final_df)} fighters from the local snapshot ({memory_mb(final_df):.1f} MiB).")
+    else:
+        final_df = load_fighters(supabase)
+
+    new_fights_df['winner_id'] = parse_fighter_ids(new_fights_df['winner_id'])
+    new_fights_df['loser_id'] = parse_fighter_ids(new_fights_df['loser_id'])
+    new_fights_df = new_fights_df[new_fights_df['winner_id'].notnull() & new_fights_df['loser_id'].notnull()]
+    new_fights_df = new_fights_df.astype({'winner_id': 'int64', 'loser_id': 'int64'})
+
+    # Keep the rows as fetched to diff against before writing, final_df is updated in place below
+    fetched_df = final_df.copy()
+
+    # Check for duplicates in final_df before any processing  ->>> Temorarily not checking for duplication cause I think it sucks
+    # initial_duplicates = final_df[final_df['fighter_id'].duplicated(keep=False)]
+
+    # if not initial_duplicates.empty:
+    #     print("Duplicates found in final_df before processing:")
+    #     print(initial_duplicates)
+    #     # Drop duplicates, keeping the first occurrence
+    #     final_df = final_df.drop_duplicates(subset='fighter_id', keep='first')
+    #     print("Duplicates have been removed from final_df.")
+
+    # MATCHING ERROR CHECKING LOGS
+    print("\nSample fighter_ids from final_df:")
+    print(final_df['fighter_id'].head(5).tolist())
+
+    print("\nSample winner_ids from new_fights_df:")
+    print(new_fights_df['winner_id'].head(5).tolist())
+
+    print("\nSample loser_ids from new_fights_df:")
+    print(new_fights_df['loser_id'].head(5).tolist())
+    # END MATCHING ERROR CHECKING LOGS
+
+    # Map fighter ids to dense indexes: existing fighters first, new fighters in order of first appearance
+    known_idx, winner_idx, loser_idx, fighter_ids = index_fighters(
+        final_df['fighter_id'], new_fights_df['winner_id'], new_fights_df['loser_id']
+    )
+    new_fights_df['winner_idx'] = winner_idx
+    new_fights_df['loser_idx'] = loser_idx
+
+    # Existing fighters start from their current elos, new fighters from 1200; one column per variant
+    current_columns = [variant['current_column'] for variant in VARIANTS.values()]
+    current_elos = initial_ratings(len(fighter_ids), known_idx, final_df[current_columns])
+
+    # Running peaks next to the ratings, advanced with the new fights below
+    peaks = initial_peaks(
+        current_elos, known_idx,
+        final_df[[variant['peak_column'] for variant in VARIANTS.values()]],
+        final_df[[variant['peak_date_column'] for variant in VARIANTS.values()]],
+        final_df[[variant['days_peak_column'] for variant in VARIANTS.values()]],
+    )
+    best_wins = initial_best_wins(
+        len(fighter_ids), known_idx,
+        final_df[[variant['best_win_column'] for variant in VARIANTS.values()]],
+        final_df[[variant['best_win_elo_column'] for variant in VARIANTS.values()]],
+        len(VARIANTS),
+    )
+
+    # Collect new fighters with the name of their first appearance
+    n_known = int(known_idx.max()) + 1 if len(known_idx) else 0
+    appearance_idx = np.concatenate([winner_idx, loser_idx])
+    appearance_names = pd.concat([new_fights_df['winner_name'], new_fights_df['loser_name']], ignore_index=True)
+    _, first_appearance = np.unique(appearance_idx, return_index=True)
+    first_appearance = np.sort(first_appearance)
+    new_fighters = [
+        {'fighter_id': int(fighter_ids[idx]), 'name': name}
+        for idx, name in zip(appearance_idx[first_appearance].tolist(), appearance_names.iloc[first_appearance].tolist())
+        if idx >= n_known
+    ]
+
+    print(f"Number of fighters in final_df after cleaning: {final_df['fighter_id'].nunique()}")
+    print(f"Number of fighters in current_elos: {len(current_elos)}")
+
+    # Initialize elo ratings for calculations
+    elo_ratings = current_elos.copy()
+
+    # Sort fights by date
+    new_fights_df['event_date'] = pd.to_datetime(new_fights_df['event_date'])
+    if ELO_UPDATE_MODE == 'card':
+        new_fights_df.sort_values(['event_date', 'id'], kind='mergesort', inplace=True)
     else:
-        print(f"Skipping fighter_id {fighter_id} as it already exists in final_df.")
+        new_fights_df.sort_values('event_date', inplace=True)
+
+    # Process each fight
+    is_ko_or_sub = new_fights_df['dom'].isin(['ko', 'sub']).to_numpy()
+    is_round_one = (new_fights_df['round'].astype(str) == '1').to_numpy()
+
+    elo_columns = (run_fights_batched if ELO_UPDATE_MODE == 'card' else run_fights)(
+        new_fights_df['winner_idx'].to_numpy(), new_fights_df['loser_idx'].to_numpy(),
+        k_factors(is_ko_or_sub, is_round_one), elo_ratings
+    )
+
+    # Peaks, peak dates, days at peak and best wins from the new ratings
+    fight_days = to_days(new_fights_df['event_date'])
+    update_peaks(peaks, new_fights_df['winner_idx'].to_numpy(), new_fights_df['loser_idx'].to_numpy(),
+                 fight_days, elo_columns)
+    update_best_wins(best_wins, new_fights_df['winner_idx'].to_numpy(), new_fights_df['loser_idx'].to_numpy(),
+                     new_fights_df['loser_name'].to_numpy(), fight_days, elo_columns)
+    last_fights = last_fight_days(len(fighter_ids), known_idx, final_df['last_fight_date'],
+                                  new_fights_df['winner_idx'].to_numpy(), new_fights_df['loser_idx'].to_numpy(), fight_days)
+
+    result_frames = build_result_frames(new_fights_df, elo_columns)
+
+    # Create dataframe of new elos, peaks and best wins
+    elo_updates = pd.concat([
+        pd.DataFrame(elo_ratings, columns=current_columns), peak_frame(peaks), best_win_frame(best_wins)
+    ], axis=1)
+    elo_updates.insert(0, 'fighter_id', fighter_ids)
+    elo_updates['last_fight_date'] = day_strings(last_fights)
+
+    # Set fighter_id as the index for both dataframes
+    final_df.set_index('fighter_id', inplace=True)
+    elo_updates.set_index('fighter_id', inplace=True)
+
+    # Update final_df with elo_updates
+    final_df.update(elo_updates)
+
+    # Reset index to turn fighter_id back into a column
+    final_df.reset_index(inplace=True)
+
+    # Ensure unique fighter_ids when adding new fighters
+    existing_fighter_ids = set(final_df['fighter_id'])
+
+    # Ratings and peaks of the new fighters
+    new_fighter_elos = elo_updates.loc[[new_fighter['fighter_id'] for new_fighter in new_fighters]].to_dict(orient='index')
+
+    # Filter out any new_fighters that already exist in final_df
+    filtered_new_fighters = []
+    for new_fighter in new_fighters:
+        fighter_id = new_fighter['fighter_id']
+        if fighter_id not in existing_fighter_ids:
+            # Add missing fields with default values
+            new_fighter.update({
+                'best_win_dom': 'unknown',
+                'best_win': 'unknown',
+                'nationality': 'unknown',
+                'birthplace': 'unknown',
+                'birth_date': 'unknown',
+                'association': 'unknown',
+                'weight_class': 'unknown',
+                'age': 'unknown',
+                'weight' : 'unknown',
+                'height' : 'unknown',
+                'nickname' : 'unknown'
+            })
+            new_fighter.update({
+                col: value for col, value in new_fighter_elos[fighter_id].items()
+                if value is not None and value == value  # no best win yet stays 'unknown'
+            })
+            filtered_new_fighters.append(new_fighter)
+        else:
+            print(f"Skipping fighter_id {fighter_id} as it already exists in final_df.")
 
-new_fighters = filtered_new_fighters  # Update the new_fighters list
-
-# Create a df from the list of new fighters
-new_fighters_df = pd.DataFrame(new_fighters)
-
-# Concatenate new_fighters_df with final_df
-final_df = pd.concat([final_df, new_fighters_df], ignore_index=True, sort=False)
-
-# After concatenation, remove any duplicates
-final_df = final_df.drop_duplicates(subset='fighter_id', keep='first')
-
-# Fill NaN values appropriately
-
-# Define numeric and string columns
-numeric_cols = [
-    'days_peak', 'days_peak_dom','peak_elo_dom', 'peak_elo', 'current_elo',
-    'current_elo_dom'
-]
-
-string_cols = [
-    'name', 'best_win_dom', 'best_win', 'nationality',
-    'birthplace', 'birth_date', 'association', 'weight_class', 'age', 'weight', 'height', 'nickname'
-]
-
-# Remove duplicates from column lists
-numeric_cols = list(dict.fromkeys(numeric_cols))
-string_cols = list(dict.fromkeys(string_cols))
-
-# Verify that all columns exist in final_df
-existing_numeric_cols = [col for col in numeric_cols if col in final_df.columns]
-missing_numeric_cols = [col for col in numeric_cols if col not in final_df.columns]
-
-if missing_numeric_cols:
-    print(f"Warning: The following numeric columns are missing in final_df and will be skipped: {missing_numeric_cols}")
-
-existing_string_cols = [col for col in string_cols if col in final_df.columns]
-missing_string_cols = [col for col in string_cols if col not in final_df.columns]
-
-if missing_string_cols:
-    print(f"Warning: The following string columns are missing in final_df and will be skipped: {missing_string_cols}")
-
-# Perform the fillna operation only on existing columns
-final_df[existing_numeric_cols] = final_df[existing_numeric_cols].fillna(0)
-final_df[existing_string_cols] = final_df[existing_string_cols].fillna('unknown')
-
-# Ensure 'rn' column is present if required
-if 'rn' in final_df.columns:
-    final_df['rn'] = final_df['rn'].fillna(1).astype(int)
-
-data_final = final_df.to_dict(orient='records')
-
-# Final duplicate check
-final_duplicates = final_df[final_df['fighter_id'].duplicated(keep=False)]
-
-if not final_duplicates.empty:
-    print("Duplicates found in final_df after processing:")
-    print(final_duplicates)
-    sys.exit(1)
-else:
-    print("No duplicates found in final_df after processing.")
-
-# Update Supabase tables
-# Delete existing data (if needed)
-# supabase.table('fighters_enriched_new').delete().neq('name', 'unknown').execute()
-batch_delete('fighters_enriched_new', batch_size=1000)
-
-# Insert updated data
-final_df = final_df.replace([np.inf, -np.inf], np.nan)
-final_df = final_df.replace({np.nan: None})
-
-print("\n--- Columns, Data Types, and Sample Value in final_df before Conversion ---")
-if final_df.empty:
-    print("final_df is empty, cannot display sample values.")
-else:
-    for col in final_df.columns:
-        col_type = final_df[col].dtype
-        sample_value = final_df[col].iloc[0]
-        print(f"Column: {col}, dtype: {col_type}, example value: {repr(sample_value)}")
-
-desired_dtypes = {
-
-    'fighter_id': 'int64',
-    'id': 'int64',
-    
-
-    'peak_elo': 'float64',   
-    'peak_elo_dom': 'float64',
-    'current_elo': 'float64',
-    'current_elo_dom': 'float64',
-    'days_peak': 'float32',    
-    'days_peak_dom': 'float64',
-
-
-    'rank_elo': 'Int64',         
-    'rank_elo_dom': 'Int64',
-    
-    'name': 'string',
-    'best_win': 'string',
-    'best_win_dom': 'string',
-    'nickname': 'string',
-    'nationality': 'string',
-    'birthplace': 'string',
-    'age': 'string',
-    'birth_date': 'string',
-    'height': 'string',
-    'weight': 'string',
-    'association': 'string',
-    'weight_class': 'string'
-}
-final_df.drop(columns=['id'], errors='ignore', inplace=True)
-
-print("\n--- Converting columns to desired dtypes ---")
-
-for col, dtype in desired_dtypes.items():
-    if col not in final_df.columns:
-        print(f"  [Warning] Column '{col}' not in final_df; skipping.")
-        continue
-    
-    if dtype in ['int64', 'Int64', 'float64', 'float32']:
-        final_df[col] = pd.to_numeric(final_df[col], errors='coerce')
-        
-    try:
-        final_df[col] = final_df[col].astype(dtype)
-    except ValueError as e:
-        print(f"  [Error] Converting '{col}' to {dtype} failed: {e}")
-    
-    if dtype == 'int64':
-        if final_df[col].isnull().any():
-            raise ValueError(
-                f"  [Error] Column '{col}' has null values but must be non-nullable (int64)."
-            )
-
-print("\n--- Final Columns, Data Types, and a Sample Value ---")
-if final_df.empty:
-    print("final_df is empty, cannot display sample values.")
-else:
-    for col in final_df.columns:
-        col_type = final_df[col].dtype
-        sample_value = final_df[col].iloc[0]
-        print(f"  Column: {col}, dtype: {col_type}, example: {repr(sample_value)}")
-
-data_final_records = final_df.to_dict(orient='records')
-batch_insert('fighters_enriched_new', data_final_records, batch_size=10000)
-
-
-if new_fighters:
-    supabase.table('new_fighters').insert(new_fighters).execute()
+    new_fighters = filtered_new_fighters  # Update the new_fighters list
+
+    # Create a df from the list of new fighters
+    new_fighters_df = normalize_fighters(pd.DataFrame(new_fighters), fill=False, verbose=False)
+
+    # Concatenate new_fighters_df with final_df
+    final_df = concat_fighters([final_df, new_fighters_df])
+
+    # After concatenation, remove any duplicates
+    final_df = final_df.drop_duplicates(subset='fighter_id', keep='first')
+
+    # Final duplicate check
+    final_duplicates = final_df[final_df['fighter_id'].duplicated(keep=False)]
+
+    if not final_duplicates.empty:
+        print("Duplicates found in final_df after processing:")
+        print(final_duplicates)
+        sys.exit(1)
+    else:
+        print("No duplicates found in final_df after processing.")
+
+    print("\n--- Columns, Data Types, and Sample Value in final_df before Conversion ---")
+    print_sample_values(final_df)
+
+    final_df = normalize_fighters(final_df)
+
+    print("\n--- Final Columns, Data Types, and a Sample Value ---")
+    print_sample_values(final_df)
+
+    # Database writes run in order on a background thread while the ranks are computed; the inputs
+    # handed over aren't modified afterwards. After a failed write the rest are skipped, so the raw
+    # results and rated_at stamps only go out once the fighter table is written, and fights whose
+    # fighters weren't written are rated again by the next run
+    write_start = time.perf_counter()
+    writer = BackgroundWriter()
+
+    # Only write fighters that are new or changed compared to the rows fetched at startup
+    fetched_df = normalize_fighters(fetched_df, verbose=False)
+    changed_df = diff_rows(fetched_df, final_df, 'fighter_id')
+    print(f"{len(changed_df)} of {len(final_df)} fighters are new or changed.")
+
+    if from_snapshot:
+        # the snapshot may be behind on columns other tools edit, existing fighters only get the rating columns
+        existing = changed_df['fighter_id'].isin(fetched_df['fighter_id'])
+        rating_records = to_records(changed_df.loc[existing, ['fighter_id'] + RATING_COLUMNS])
+        writer.submit(batch_upsert, supabase, 'fighters_enriched_new', rating_records, 'fighter_id', 10000,
+                      items=len(rating_records))
+        changed_df = changed_df[~existing]
+
+    data_final_records = to_records(changed_df)
+    writer.submit(batch_upsert, supabase, 'fighters_enriched_new', data_final_records, 'fighter_id', 10000,
+                  items=len(data_final_records))
+
+    if new_fighters:
+        writer.submit(insert_new_fighters, supabase, new_fighters, items=len(new_fighters))
+
+    # Ranks overall and per weight class go to their own table, only the rows that changed. A valid
+    # snapshot means the last run wrote the ranks of the fighters as fetched, otherwise they're read back
+    rank_df = rank_fighters(final_df)
+    previous_ranks = rank_fighters(fetched_df) if from_snapshot else read_ranks(supabase)
+    writer.submit(write_ranks, supabase, rank_df, previous_ranks)
+
+    writer.submit(insert_raw_results, supabase, result_frames, items=len(new_fights_df))
+    if fight_ids is not None:
+        writer.submit(mark_rated, supabase, fight_ids)
+    if RATING_HISTORY_PATH:
+        writer.submit(update_rating_history, supabase, new_fights_df, fight_days, elo_columns)
+
+    # the snapshot's watermark has to see the raw inserts
+    writer.close()
+    print_stage_stats([writer.stats], time.perf_counter() - write_start)
+
+    if ELO_SNAPSHOT:
+        save_snapshot(final_df, table_watermark(supabase))
+
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+def main():
+    # Initialize Supabase client
+    supabase = get_client()
+
+    new_fights_df = load_new_fights(supabase)
+    if new_fights_df.empty:
+        print("No new fights to rate.")
+        return
+    update_ratings(supabase, new_fights_df)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import sys
+import time
+
+import pandas as pd
+
+from storage import TABLES
+
+
+def _write_batches(action, supabase_table, data, batch_size, write):
+    total_records = len(data)
+    print(f"Starting batch {action} into '{supabase_table}' with {total_records} records.")
+    for i in range(0, total_records, batch_size):
+        batch = data[i:i + batch_size]
+        print(f"{action.capitalize()}ing records {i + 1} to {i + len(batch)}...")
+        retries = 3
+        while retries > 0:
+            try:
+                write(batch)
+                break  # Break the retry loop if successful
+            except Exception as e:
+                retries -= 1
+                print(f"Error {action}ing records {i + 1} to {i + len(batch)}: {e}")
+                if retries > 0:
+                    print(f"Retrying... ({3 - retries} retries left)")
+                    time.sleep(1)  # Wait a bit before retrying
+                else:
+                    print("Failed to write batch after retries. Exiting.")
+                    sys.exit(1)
+    print(f"Finished batch {action} into '{supabase_table}'.")
+
+
+def batch_insert(client, supabase_table, data, batch_size=10000):
+    _write_batches('insert', supabase_table, data, batch_size,
+                   lambda batch: client.table(supabase_table).insert(batch).execute())
+
+
+def batch_upsert(client, supabase_table, data, on_conflict, batch_size=10000):
+    # keyed writes: rows matching on_conflict are updated in place, the rest inserted
+    _write_batches('upsert', supabase_table, data, batch_size,
+                   lambda batch: client.table(supabase_table).upsert(batch, on_conflict=on_conflict).execute())
+
+
+def diff_rows(old_df, new_df, key):
+    # rows of new_df whose key is missing from old_df or whose values differ in any column
+    old = old_df.drop_duplicates(subset=key, keep='last').set_index(key)
+    new = new_df.set_index(key)
+    old = old.reindex(index=new.index, columns=new.columns)
+
+    changed = ~new.index.isin(old_df[key])
+    for col in new.columns:
+        new_col = new[col]
+        old_col = old[col]
+        if isinstance(new_col.dtype, pd.CategoricalDtype) and isinstance(old_col.dtype, pd.CategoricalDtype):
+            # categoricals only compare over the same categories
+            categories = new_col.cat.categories.union(old_col.cat.categories)
+            new_col = new_col.cat.set_categories(categories)
+            old_col = old_col.cat.set_categories(categories)
+        same = (new_col == old_col).fillna(False) | (new_col.isnull() & old_col.isnull())
+        changed |= ~same.to_numpy(dtype=bool)
+    return new_df[changed]
+
+
+def to_records(df):
+    # row dicts for the client with None for every missing value (NaN, NA, NaT), built one
+    # column at a time instead of converting the whole frame to object first
+    columns = []
+    for col in df.columns:
+        values = df[col].to_numpy(dtype=object)
+        values[df[col].isnull().to_numpy()] = None
+        columns.append(values)
+    names = list(df.columns)
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def iter_pages(client, table_name, columns='*', key='id', page_size=10000, dtypes=None, where=None):
+    # keyset pagination: each page asks for key > last key seen, so the cost of a page
+    # doesn't grow with the table. Pages come back as DataFrame blocks, only one page
+    # of row dicts is alive at a time. A page shorter than page_size doesn't end the
+    # scan (the server row cap can be lower), only an empty page does.
+    # where(query) adds filters to every query, e.g. lambda query: query.is_('rated_at', 'null')
+    where = where or (lambda query: query)
+    selected = [col.strip() for col in columns.split(',') if col.strip()]
+    if selected != ['*'] and key not in selected:
+        columns = f"{columns}, {key}"
+
+    expected = where(client.table(table_name).select(key, count='exact')).limit(1).execute().count
+    last_key = None
+    total = 0
+    while True:
+        query = where(client.table(table_name).select(columns)).order(key).limit(page_size)
+        if last_key is not None:
+            query = query.gt(key, last_key)
+        data = query.execute().data
+        if not data:
+            break
+
+        block = pd.DataFrame(data)
+        del data
+        keys = block[key]
+        if keys.isnull().any() or not keys.is_monotonic_increasing or not keys.is_unique:
+            raise ValueError(f"'{table_name}.{key}' must be unique and non-null for keyset pagination.")
+        if dtypes:
+            block = block.astype({col: dtype for col, dtype in dtypes.items() if col in block.columns})
+
+        last_key = keys.iloc[-1]
+        total += len(block)
+        yield block
+
+    if expected is not None and total != expected:
+        raise RuntimeError(f"Read {total} rows from '{table_name}' but the table has {expected}.")
+
+
+def read_table(client, table_name, columns='*', key='id', page_size=10000, dtypes=None, where=None):
+    blocks = list(iter_pages(client, table_name, columns, key, page_size, dtypes, where))
+    if not blocks:
+        return empty_frame(table_name, columns, key, dtypes)
+    return pd.concat(blocks, ignore_index=True)
+
+
+def empty_frame(table_name, columns='*', key='id', dtypes=None):
+    # no rows but the columns a read would have returned, '*' being the table's columns in storage.TABLES
+    selected = [col.strip() for col in columns.split(',') if col.strip()]
+    if selected == ['*']:
+        selected = ['id'] + list(TABLES.get(table_name, {}))
+    elif key not in selected:
+        selected.append(key)
+    dtypes = dtypes or {}
+    return pd.DataFrame({col: pd.Series(dtype=dtypes.get(col, object)) for col in selected})
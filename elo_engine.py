@@ -0,0 +1,373 @@
+import numpy as np
+import pandas as pd
+
+K_FACTOR = 60
+INITIAL_ELO = 1200.0
+
+# rating systems computed side by side, one column each in the fighters x variants ratings
+# matrix. A KO or submission win multiplies the K-factor by ko_sub, or by round_one instead
+# when it came in the first round. The *_column and raw_table entries are where calculate_elo
+# stores a variant's ratings, peaks, best wins and ranks.
+VARIANTS = {
+    'normal': {
+        'k_factor': K_FACTOR, 'ko_sub': 1, 'round_one': 1, 'initial': INITIAL_ELO,
+        'current_column': 'current_elo', 'raw_table': 'fighters_regular_raw',
+        'peak_column': 'peak_elo', 'peak_date_column': 'peak_date', 'days_peak_column': 'days_peak',
+        'best_win_column': 'best_win', 'best_win_elo_column': 'best_win_elo',
+        'rank_column': 'rank_elo', 'class_rank_column': 'class_rank_elo',
+    },
+    'dom': {
+        'k_factor': K_FACTOR, 'ko_sub': 1.5, 'round_one': 2, 'initial': INITIAL_ELO,
+        'current_column': 'current_elo_dom', 'raw_table': 'fighters_dom_raw',
+        'peak_column': 'peak_elo_dom', 'peak_date_column': 'peak_date_dom', 'days_peak_column': 'days_peak_dom',
+        'best_win_column': 'best_win_dom', 'best_win_elo_column': 'best_win_elo_dom',
+        'rank_column': 'rank_elo_dom', 'class_rank_column': 'class_rank_elo_dom',
+    },
+}
+FIGHT_COLUMNS = [
+    'id', 'winner_id', 'winner_name', 'loser_id', 'loser_name', 'event_name',
+    'event_date', 'winby', 'referee', 'round', 'dom'
+]
+OPTIONAL_FIGHT_COLUMNS = ['fight_key']  # carried into the raw tables when the fights have them
+RESULT_COLUMNS = ['winner_elo_before', 'winner_elo_after', 'loser_elo_before', 'loser_elo_after']
+NO_DAY = np.iinfo(np.int64).min  # unknown peak date
+
+
+def parse_fighter_ids(ids):
+    # fighter ids as nullable int64, vectorized int(float(fid)): '2245', '2245.0' and 2245 all
+    # give 2245, empty or unparseable ids give <NA>. ids only become strings again when written
+    ids = ids if isinstance(ids, pd.Series) else pd.Series(ids, dtype=object)
+    try:
+        numbers = ids.astype('float64')  # fast path, clean columns parse in one pass
+    except (TypeError, ValueError):
+        numbers = pd.to_numeric(ids, errors='coerce').astype('float64')
+    return np.trunc(numbers.where(np.isfinite(numbers))).astype('Int64')
+
+
+def index_fighters(known_ids, winner_ids, loser_ids):
+    # dense integer index: known fighters first, then fighters in order of first appearance
+    # returns (known codes, winner codes, loser codes, fighter ids by index); int64 ids from
+    # parse_fighter_ids hash as plain integers
+    all_ids = pd.concat([pd.Series(known_ids), pd.Series(winner_ids), pd.Series(loser_ids)], ignore_index=True)
+    codes, uniques = pd.factorize(all_ids)
+    n_known = len(known_ids)
+    n_winners = len(winner_ids)
+    return (
+        codes[:n_known],
+        codes[n_known:n_known + n_winners],
+        codes[n_known + n_winners:],
+        np.asarray(uniques),
+    )
+
+
+def initial_ratings(n_fighters, known_codes, known_ratings, variants=VARIANTS):
+    # (n_fighters, n_variants) matrix, known_ratings has one column per variant.
+    # unknown fighters start at the variant's initial rating, a repeated id keeps the value of its last row
+    ratings = np.tile([variant['initial'] for variant in variants.values()], (n_fighters, 1)).astype(float)
+    known = pd.DataFrame(np.asarray(known_ratings, dtype=object).reshape(len(known_codes), len(variants)))
+    ratings[known_codes] = known.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    return ratings
+
+
+def k_factors(is_ko_or_sub, is_round_one, variants=VARIANTS):
+    # (n_fights, n_variants) K-factor of every fight under every variant
+    k = np.array([variant['k_factor'] for variant in variants.values()], dtype=float)
+    ko_sub = np.array([variant['ko_sub'] for variant in variants.values()], dtype=float)
+    round_one = np.array([variant['round_one'] for variant in variants.values()], dtype=float)
+    is_ko_or_sub = np.asarray(is_ko_or_sub, dtype=bool)[:, None]
+    is_round_one = np.asarray(is_round_one, dtype=bool)[:, None]
+    return k * np.where(is_ko_or_sub, np.where(is_round_one, round_one, ko_sub), 1.0)
+
+
+def run_fights(winner_idx, loser_idx, fight_k, ratings):
+    # walks the date-sorted fights once, updating every variant's column of the ratings matrix in place.
+    # fight_k is the k_factors() matrix, returns {column: (n_fights, n_variants) array} with the
+    # before/after rating of every fight
+    n_fights, n_variants = len(winner_idx), ratings.shape[1]
+    columns = {col: np.empty((n_fights, n_variants)) for col in RESULT_COLUMNS}
+    winner_before, winner_after, loser_before, loser_after = (columns[col] for col in RESULT_COLUMNS)
+
+    # the loop runs on plain python floats so that round() behaves exactly like
+    # the old dict based loop (numpy rounds float64 scalars differently); per fight numpy
+    # over a handful of variants is slower than this loop, the matrix only pays off per row
+    rows = ratings.tolist()
+    variant_range = range(n_variants)
+    fights = zip(np.asarray(winner_idx).tolist(), np.asarray(loser_idx).tolist(), np.asarray(fight_k).tolist())
+    for i, (w, l, k) in enumerate(fights):
+        winner_row = rows[w]
+        loser_row = rows[l]
+        if w == l:
+            winner_row = list(winner_row)  # keep the winner's values apart, the loser's are stored
+        winner_before[i] = winner_row
+        loser_before[i] = loser_row
+        for v in variant_range:
+            wb = winner_row[v]
+            lb = loser_row[v]
+            delta = k[v] * (1 - 1 / (1 + 10 ** ((lb - wb) / 400)))
+            winner_row[v] = round(wb + delta, 2)
+            loser_row[v] = round(lb - delta, 2)
+        winner_after[i] = winner_row
+        loser_after[i] = loser_row
+
+    ratings[:] = rows
+    return columns
+
+
+def round_ratings(values):
+    # round(x, 2) for an array: numpy's rint(x * 100) / 100 agrees with python's correctly
+    # rounded round() unless x * 100 sits right next to a .5 tie, those few go through round()
+    scaled = values * 100
+    rounded = np.rint(scaled) / 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(x, 2) for x in values[near_tie].tolist()]
+    return rounded
+
+
+def fight_waves(winner_idx, loser_idx, n_fighters):
+    # dependency wave of every fight: one more than the latest earlier wave of either fighter.
+    # fights in the same wave share no fighter, so they can be rated together
+    last_wave = [0] * n_fighters
+    waves = []
+    for w, l in zip(np.asarray(winner_idx).tolist(), np.asarray(loser_idx).tolist()):
+        wave = last_wave[w]
+        if last_wave[l] > wave:
+            wave = last_wave[l]
+        wave += 1
+        last_wave[w] = last_wave[l] = wave
+        waves.append(wave)
+    return np.array(waves, dtype=np.int64)
+
+
+def run_fights_batched(winner_idx, loser_idx, fight_k, ratings):
+    # same inputs and output as run_fights, but each dependency wave is one vectorized update.
+    # every fight still sees its fighters' ratings after their previous fight, so a card is
+    # rated against the pre-card ratings and a fighter with two fights on one date gets them
+    # in stored order; the ratings are identical to run_fights
+    winner_idx = np.asarray(winner_idx)
+    loser_idx = np.asarray(loser_idx)
+    fight_k = np.asarray(fight_k, dtype=float)
+    n_fights, n_variants = len(winner_idx), ratings.shape[1]
+    columns = {col: np.empty((n_fights, n_variants)) for col in RESULT_COLUMNS}
+    winner_before, winner_after, loser_before, loser_after = (columns[col] for col in RESULT_COLUMNS)
+
+    waves = fight_waves(winner_idx, loser_idx, len(ratings))
+    order = np.argsort(waves, kind='stable')
+    bounds = np.flatnonzero(np.diff(waves[order])) + 1
+    for batch in np.split(order, bounds):
+        if not len(batch):
+            continue
+        w = winner_idx[batch]
+        l = loser_idx[batch]
+        wb = ratings[w]
+        lb = ratings[l]
+        delta = fight_k[batch] * (1 - 1 / (1 + 10 ** ((lb - wb) / 400)))
+        wa = round_ratings(wb + delta)
+        la = round_ratings(lb - delta)
+        ratings[w] = wa
+        ratings[l] = la
+        winner_before[batch] = wb
+        loser_before[batch] = lb
+        winner_after[batch] = wa
+        loser_after[batch] = la
+
+    return columns
+
+
+def build_result_frames(fights_df, elo_columns, variants=VARIANTS):
+    # one raw results frame per variant: fight metadata in fight order plus that variant's rating columns
+    fights_sorted = fights_df[FIGHT_COLUMNS + [col for col in OPTIONAL_FIGHT_COLUMNS if col in fights_df.columns]]
+    fights_sorted = fights_sorted.reset_index(drop=True)
+    fights_sorted['event_date'] = fights_sorted['event_date'].astype(str)
+    fights_sorted[['winner_id', 'loser_id']] = fights_sorted[['winner_id', 'loser_id']].astype(str)
+    return {
+        name: fights_sorted.assign(**{col: elo_columns[col][:, j] for col in RESULT_COLUMNS})
+        for j, name in enumerate(variants)
+    }
+
+
+def to_days(dates):
+    # dates (strings or datetimes) as int64 days since epoch, NO_DAY where missing
+    dates = pd.to_datetime(pd.Series(dates, dtype=object), errors='coerce')
+    days = dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+    days[dates.isnull().to_numpy()] = NO_DAY
+    return days
+
+
+def day_strings(days):
+    # 'YYYY-MM-DD' per day since epoch, None for NO_DAY
+    dates = pd.Series(np.asarray(days).astype('datetime64[D]').astype(str), dtype=object)
+    dates[np.asarray(days) == NO_DAY] = None
+    return dates.to_numpy()
+
+
+def last_fight_days(n_fighters, known_codes, known_dates, winner_idx, loser_idx, fight_days):
+    # day of every fighter's latest fight, the stored last_fight_date moved forward by the batch
+    last = np.full(n_fighters, NO_DAY)
+    last[known_codes] = to_days(known_dates)
+    np.maximum.at(last, np.concatenate([winner_idx, loser_idx]).astype(np.int64),
+                  np.concatenate([fight_days, fight_days]))
+    return last
+
+
+def _known_matrix(values, n_known, n_variants):
+    values = pd.DataFrame(np.asarray(values, dtype=object).reshape(n_known, n_variants))
+    return values.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+
+def initial_peaks(ratings, known_codes, known_peaks, known_peak_dates, known_days_peak):
+    # per-fighter peak state next to the ratings matrix, every array is (n_fighters, n_variants):
+    # running peak, day it was reached (NO_DAY if unknown), days a peak that is already over was
+    # held, and whether the fighter is still at it. known_* have one column per variant,
+    # new fighters start at their initial rating
+    n_fighters, n_variants = ratings.shape
+    n_known = len(known_codes)
+    peak = ratings.copy()
+    # stale peaks below the current rating are lifted to it
+    peak[known_codes] = np.fmax(_known_matrix(known_peaks, n_known, n_variants), ratings[known_codes])
+    peak_day = np.full((n_fighters, n_variants), NO_DAY)
+    known_dates = np.asarray(known_peak_dates, dtype=object).reshape(n_known, n_variants)
+    peak_day[known_codes] = np.column_stack([to_days(known_dates[:, v]) for v in range(n_variants)])
+    days_peak = np.zeros((n_fighters, n_variants))
+    days_peak[known_codes] = np.nan_to_num(_known_matrix(known_days_peak, n_known, n_variants))
+    return {'peak': peak, 'peak_day': peak_day, 'days_peak': days_peak, 'at_peak': ratings >= peak}
+
+
+def update_peaks(peaks, winner_idx, loser_idx, fight_days, elo_columns):
+    # advances the peak state over a batch of rated fights (run_fights output, same fight order).
+    # every after-rating at or above the fighter's running peak sets the peak and its day (so a
+    # fighter is at peak exactly when current >= peak, which is how initial_peaks reloads it);
+    # a peak is over at the fighter's next fight, the days in between are days_peak
+    n_fights = len(winner_idx)
+    if n_fights == 0:
+        return peaks
+    fighters = np.concatenate([winner_idx, loser_idx])
+    position = np.concatenate([np.arange(n_fights) * 2, np.arange(n_fights) * 2 + 1])
+    order = np.lexsort((position, fighters))  # each fighter's appearances in fight order
+    fighters = fighters[order]
+    days = np.concatenate([fight_days, fight_days])[order]
+    afters = np.concatenate([elo_columns['winner_elo_after'], elo_columns['loser_elo_after']])[order]
+
+    first = np.r_[True, fighters[1:] != fighters[:-1]]
+    last = np.r_[first[1:], True]
+    group = np.cumsum(first) - 1
+    group_fighter = fighters[first]
+    first_idx = np.flatnonzero(first)
+    appearance = np.arange(len(fighters))
+
+    for v in range(afters.shape[1]):
+        after = afters[:, v]
+        peak = peaks['peak'][group_fighter, v]
+        peak_day = peaks['peak_day'][group_fighter, v]
+        days_peak = peaks['days_peak'][group_fighter, v]
+        at_peak = peaks['at_peak'][group_fighter, v]
+
+        # highest rating before each appearance, starting from the stored peak
+        running = pd.Series(after).groupby(group).cummax().to_numpy()
+        before = np.r_[-np.inf, running[:-1]]
+        before[first] = -np.inf
+        new_peak = after >= np.maximum(before, peak[group])
+        last_new = pd.Series(np.where(new_peak, appearance, -1)).groupby(group).max().to_numpy()
+
+        # a peak held coming into the batch ends at the first appearance below it. A late result
+        # (repoll_events) can be dated before the peak it ends, that peak was held for 0 days
+        closes = at_peak & (last_new < 0)
+        known = closes & (peak_day != NO_DAY)
+        days_peak[known] = np.maximum(days[first_idx[known]] - peak_day[known], 0)
+        at_peak[closes] = False
+
+        # new peaks: still held if set on the fighter's last appearance, otherwise until the next one
+        moved = last_new >= 0
+        j = last_new[moved]
+        peak[moved] = after[j]
+        peak_day[moved] = days[j]
+        still = last[j]
+        at_peak[moved] = still
+        days_peak[moved] = np.where(still, 0, np.maximum(days[np.minimum(j + 1, len(days) - 1)] - days[j], 0))
+
+        peaks['peak'][group_fighter, v] = peak
+        peaks['peak_day'][group_fighter, v] = peak_day
+        peaks['days_peak'][group_fighter, v] = days_peak
+        peaks['at_peak'][group_fighter, v] = at_peak
+    return peaks
+
+
+def peak_frame(peaks, variants=VARIANTS):
+    # peak, peak date and days at peak per variant in fighter index order. days_peak covers peaks
+    # that have ended (peak day to the next fight), a peak still held is 0 until the fighter fights
+    # again, so fighters who don't fight keep their row unchanged
+    days_peak = peaks['days_peak']
+    frame = {}
+    for v, variant in enumerate(variants.values()):
+        frame[variant['peak_column']] = peaks['peak'][:, v]
+        frame[variant['peak_date_column']] = day_strings(peaks['peak_day'][:, v])
+        frame[variant['days_peak_column']] = days_peak[:, v]
+    return pd.DataFrame(frame)
+
+
+def initial_best_wins(n_fighters, known_codes, known_names, known_ratings, n_variants):
+    # best win per fighter and variant, every array is (n_fighters, n_variants): opponent index
+    # (-1 if unknown), opponent name, opponent's pre-fight rating and day of the fight.
+    # known_* have one column per variant, a stored win without a rating is beaten by any new win
+    n_known = len(known_codes)
+    rating = np.full((n_fighters, n_variants), -np.inf)
+    rating[known_codes] = np.nan_to_num(_known_matrix(known_ratings, n_known, n_variants), nan=-np.inf)
+    name = np.full((n_fighters, n_variants), None, dtype=object)
+    name[known_codes] = np.asarray(known_names, dtype=object).reshape(n_known, n_variants)
+    return {
+        'opponent': np.full((n_fighters, n_variants), -1, dtype=np.int64),
+        'name': name,
+        'rating': rating,
+        'day': np.full((n_fighters, n_variants), NO_DAY),
+    }
+
+
+def update_best_wins(best_wins, winner_idx, loser_idx, loser_names, fight_days, elo_columns):
+    # a win replaces the best win when the opponent's pre-fight rating is higher, ties keep the
+    # earlier fight. one grouped pass per variant over the batch, so O(1) per fight
+    n_fights = len(winner_idx)
+    if n_fights == 0:
+        return best_wins
+    winner_idx = np.asarray(winner_idx)
+    loser_idx = np.asarray(loser_idx)
+    loser_names = np.asarray(loser_names, dtype=object)
+    for v in range(elo_columns['loser_elo_before'].shape[1]):
+        rating = elo_columns['loser_elo_before'][:, v]
+        top = pd.Series(rating).groupby(winner_idx).idxmax()  # first fight against the top opponent
+        winners = top.index.to_numpy()
+        j = top.to_numpy()
+        better = rating[j] > best_wins['rating'][winners, v]
+        winners, j = winners[better], j[better]
+        best_wins['opponent'][winners, v] = loser_idx[j]
+        best_wins['name'][winners, v] = loser_names[j]
+        best_wins['rating'][winners, v] = rating[j]
+        best_wins['day'][winners, v] = fight_days[j]
+    return best_wins
+
+
+def best_win_frame(best_wins, variants=VARIANTS):
+    # best win name and opponent rating per variant in fighter index order, None without a win
+    frame = {}
+    for v, variant in enumerate(variants.values()):
+        rating = best_wins['rating'][:, v]
+        frame[variant['best_win_column']] = best_wins['name'][:, v]
+        frame[variant['best_win_elo_column']] = np.where(np.isfinite(rating), rating, np.nan)
+    return pd.DataFrame(frame)
+
+
+def best_wins_from_raw(raw_frames, variants=VARIANTS):
+    # bulk rebuild: the best win of every fighter straight from the raw results tables
+    # ({variation: frame with id, winner_id, loser_name, loser_elo_before, event_date}),
+    # one grouped pass per variant with the same tie rule as update_best_wins
+    frames = []
+    for name, variant in variants.items():
+        raw = raw_frames[name].assign(event_date=pd.to_datetime(raw_frames[name]['event_date']))
+        raw = raw[pd.to_numeric(raw['loser_elo_before'], errors='coerce').notnull()]
+        raw = raw.sort_values(['event_date', 'id'], kind='mergesort').reset_index(drop=True)
+        rating = pd.to_numeric(raw['loser_elo_before'])
+        top = rating.groupby(raw['winner_id']).idxmax()
+        frames.append(pd.DataFrame({
+            variant['best_win_column']: raw['loser_name'].to_numpy()[top.to_numpy()],
+            variant['best_win_elo_column']: rating.to_numpy()[top.to_numpy()],
+        }, index=pd.Index(top.index, name='fighter_id')))
+    return pd.concat(frames, axis=1).reset_index()
@@ -0,0 +1,233 @@
+import importlib.util
+import os
+import re
+from urllib.parse import urlparse
+
+from bs4 import BeautifulSoup
+from bs4.filter import ElementFilter
+
+# lxml tokenizes several times faster than html.parser, EVENT_PAGE_PARSER overrides the choice
+EVENT_PAGE_PARSER = os.environ.get(
+    'EVENT_PAGE_PARSER', 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+)
+
+
+# Function to extract fighter id from href  careful gpt written regex...
+def get_fighter_id(fighter_url):
+    last_part = fighter_url.split('/')[-1]
+    match = re.search(r'(\d+)$', last_part)
+    if match:
+        return match.group(1)
+    else:
+        return None
+
+# Function to get detail after label in fight details table
+def get_detail(fight_detail):
+    texts = list(fight_detail.stripped_strings)
+    if len(texts) >= 2:
+        return texts[-1]
+    elif len(texts) == 1:
+        return texts[0]
+    else:
+        return ''
+
+
+# Stable key of a fight across runs: the event page, the match number on the card and the two fighter
+# ids (sorted, so a result later corrected to the other fighter keeps its key)
+def fight_key(link, match_number, winner_id, loser_id):
+    event_path = urlparse(link).path.rstrip('/')
+    first, second = sorted([str(winner_id), str(loser_id)])
+    return f"{event_path}#{match_number}:{first}-{second}"
+
+
+class EventPageFilter(ElementFilter):
+    # only builds the regions the parser reads: the event_detail block, the startDate meta,
+    # the main event, the result tables and yet_to_come markers. A matching tag is kept
+    # with its whole subtree, everything else (nav, sidebars, scripts) is skipped while parsing.
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        if not attrs:
+            return False
+        classes = attrs.get('class') or ''
+        if not isinstance(classes, str):
+            classes = ' '.join(classes)
+        classes = classes.split()
+        if name == 'div':
+            return 'event_detail' in classes or attrs.get('itemprop') == 'subEvent'
+        if name == 'meta':
+            return attrs.get('itemprop') == 'startDate'
+        if name == 'table':
+            return 'new_table' in classes and 'result' in classes
+        if name == 'span':
+            return 'yet_to_come' in classes
+        return False
+
+    def allow_string_creation(self, string):
+        return False
+
+
+EVENT_PAGE_FILTER = EventPageFilter()
+
+
+def parse_main_event(main_event, event_name, event_date, link):
+    winner = main_event.find('div', class_='fighter left_side')
+    loser = main_event.find('div', class_='fighter right_side')
+
+    if not (winner and loser):
+        print(f"Main event fighters not found in {link}")
+        return None
+
+    winner_name = winner.find('span', itemprop='name').get_text(strip=True)
+    winner_href = winner.find('a', itemprop='url')['href']
+    winner_id = get_fighter_id(winner_href)
+    final_result_tag = winner.find('span', class_='final_result')
+    final_result = final_result_tag.get_text(strip=True) if final_result_tag else None
+
+    loser_name = loser.find('span', itemprop='name').get_text(strip=True)
+    loser_href = loser.find('a', itemprop='url')['href']
+    loser_id = get_fighter_id(loser_href)
+
+    # fight details
+    fight_details_table = main_event.find('table', class_='fight_card_resume')
+    if not fight_details_table:
+        print(f"Fight details table not found in main event in {link}")
+        return None
+
+    fight_details = fight_details_table.find_all('td')
+    match_number = get_detail(fight_details[0])
+    winby = get_detail(fight_details[1])
+    referee_text = get_detail(fight_details[2])
+    referee_tag = fight_details[2].find('a')
+    if referee_tag:
+        referee = referee_tag.get_text(strip=True)
+    else:
+        referee = referee_text
+    round_ = get_detail(fight_details[3])
+
+    print(f"Added main event: {winner_name} vs {loser_name}")
+    return {
+        'winner_id': winner_id, 'winner_name': winner_name,
+        'final_result': final_result, 'loser_name': loser_name, 'loser_id': loser_id,
+        'event_name': event_name, 'event_date': event_date, 'winby': winby,
+        'referee': referee if referee != 'N/A' else None, 'round': round_,
+        'fight_key': fight_key(link, match_number, winner_id, loser_id)
+    }
+
+
+def parse_card_row(fight, event_name, event_date, link):
+    cols = fight.find_all('td')
+    if len(cols) < 7:
+        print(f"Skipping fight due to insufficient columns in {link}")
+        return None  # skip if columns are missing
+
+    match_number = cols[0].get_text(strip=True)
+    winner_col = cols[1]
+    loser_col = cols[3]
+    winby_col = cols[4]
+    round_col = cols[5]
+
+    # winner details
+    winner_tag = winner_col.find('a', itemprop='url')
+    if not winner_tag:
+        print(f"Missing winner info in fight {match_number} in {link}")
+        return None  # skip if winner info is missing
+    winner_name = winner_col.find('span', itemprop='name').get_text(separator=' ', strip=True)
+    winner_id = get_fighter_id(winner_tag['href'])
+    final_result = winner_col.find('span', class_='final_result').get_text(strip=True)
+
+    # Loser details
+    loser_tag = loser_col.find('a', itemprop='url')
+    if not loser_tag:
+        print(f"Missing loser info in fight {match_number} in {link}")
+        return None  # skip if loser info is missing
+    loser_name = loser_col.find('span', itemprop='name').get_text(separator=' ', strip=True)
+    loser_id = get_fighter_id(loser_tag['href'])
+
+    # method and referee
+    winby_text_tag = winby_col.find('b')
+    if winby_text_tag:
+        winby_text = winby_text_tag.get_text(strip=True)
+    else:
+        winby_text = winby_col.get_text(strip=True).strip()
+    referee_tag = winby_col.find('a')
+    if referee_tag:
+        referee = referee_tag.get_text(strip=True)
+    else:
+        referee_span = winby_col.find('span', class_='sub_line')
+        referee = referee_span.get_text(strip=True) if referee_span else None
+
+    # round
+    round_ = round_col.get_text(strip=True)
+
+    print(f"Added fight {match_number}: {winner_name} vs {loser_name}")
+    return {
+        'winner_id': winner_id, 'winner_name': winner_name,
+        'final_result': final_result, 'loser_name': loser_name, 'loser_id': loser_id,
+        'event_name': event_name, 'event_date': event_date, 'winby': winby_text,
+        'referee': referee if referee != 'N/A' else None, 'round': round_,
+        'fight_key': fight_key(link, get_detail(cols[0]), winner_id, loser_id)
+    }
+
+
+def parse_event_page(html, link):
+    # returns (status, fights): status is 'fights', 'yet_to_come' or 'empty',
+    # fights are the main event followed by the card rows, without ids
+    soup = BeautifulSoup(html, EVENT_PAGE_PARSER, parse_only=EVENT_PAGE_FILTER)
+    event_detail_div = soup.find('div', class_='event_detail')
+    if not event_detail_div:
+        print(f"No event_detail found in {link}")
+        return 'empty', []
+
+    # get even name
+    event_name_tag = event_detail_div.find('h1')
+    if event_name_tag:
+        event_name = event_name_tag.get_text(separator=" ", strip=True)
+        print(f"Event Name: {event_name}")
+    else:
+        event_name = None
+        print(f"No event name found in {link}")
+
+    # get event date
+    event_date_meta = soup.find('meta', itemprop="startDate")
+    if event_date_meta:
+        event_date = event_date_meta.get('content')
+        print(f"Event Date: {event_date}")
+    else:
+        print(f"No event date found in {link}")
+        return 'empty', []
+
+    # yet to come check
+    if soup.find('span', class_='final_result yet_to_come'):
+        print(f"Results yet to come for {link}")
+        return 'yet_to_come', []
+
+    fights = []
+
+    # get main event
+    main_event = soup.find('div', itemprop='subEvent')
+    if main_event:
+        print(f"Found main event in {link}")
+        try:
+            fight = parse_main_event(main_event, event_name, event_date, link)
+            if fight:
+                fights.append(fight)
+        except Exception as e:
+            print(f"Error parsing main event in {link}: {e}")
+    else:
+        print(f"No main event found in {link}")
+
+    # scrape other fights
+    fight_rows = soup.select('table.new_table.result tr[itemprop="subEvent"]')
+    print(f"Found {len(fight_rows)} fights in {link}")
+
+    for fight_row in fight_rows:
+        try:
+            fight = parse_card_row(fight_row, event_name, event_date, link)
+            if fight:
+                fights.append(fight)
+        except Exception as e:
+            print(f"Error parsing fight in {link}: {e}")
+
+    if not fights:
+        print(f"No fights found in {link}")
+        return 'empty', []
+    return 'fights', fights
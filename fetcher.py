@@ -0,0 +1,61 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from http_client import get_http_client
+from page_cache import TTL_DEFAULT, cached_get
+
+
+class RateLimiter:
+    # spaces request starts per host so that no host sees more than requests_per_second
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def fetch_pages(urls, headers=None, max_workers=8, requests_per_second=4.0, timeout=None,
+                cache=None, offline=False, ttl=TTL_DEFAULT):
+    # fetches urls on a thread pool and yields (url, response, error) in the order of urls,
+    # whatever order the responses arrive in. At most 2 * max_workers pages are in flight
+    # or waiting to be consumed, so memory doesn't grow with the number of urls.
+    # With a PageCache, fresh pages are served from disk and don't count against the rate.
+    limiter = RateLimiter(requests_per_second)
+    client = get_http_client()
+
+    def limited_get(url, **kwargs):
+        # retries wait for a rate limiter slot too
+        return client.get(url, before_request=limiter.wait, **kwargs)
+
+    def fetch(url):
+        try:
+            return cached_get(cache, url, headers=headers, timeout=timeout, ttl=ttl, offline=offline,
+                              get=limited_get), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        url_iter = iter(urls)
+        for url in url_iter:
+            pending.append((url, executor.submit(fetch, url)))
+            if len(pending) >= 2 * max_workers:
+                break
+        while pending:
+            url, future = pending.popleft()
+            response, error = future.result()
+            for next_url in url_iter:
+                pending.append((next_url, executor.submit(fetch, next_url)))
+                break
+            yield url, response, error
@@ -1,38 +1,15 @@
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
+import json
+import time
+from datetime import datetime, timezone
 from tqdm import tqdm
-import re
 import os
-from supabase import create_client, Client
-
-SUPABASE_URL = os.environ.get('SUPABASE_URL')
-SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# initialize the lists for missing data
-yet_to_come = []
-empty_page = []
-
-# define df columns
-columns = [
-    'id', 'winner_id', 'winner_name', 'final_result', 'loser_name', 'loser_id',
-    'event_name', 'event_date', 'winby', 'referee', 'round'
-]
-results_list = []
-
-# read links from database
-response = supabase.table('event_links').select('link').execute()
-event_links = [item['link'] for item in response.data]
-
-# Function to extract fighter id from href  careful gpt written regex...
-def get_fighter_id(fighter_url):
-    last_part = fighter_url.split('/')[-1]
-    match = re.search(r'(\d+)$', last_part)
-    if match:
-        return match.group(1)
-    else:
-        return None
+from storage import get_client
+from db_utils import batch_upsert
+from event_parser import parse_event_page
+from fetcher import fetch_pages
+from http_client import get_http_client
+from page_cache import TTL_FINAL, TTL_YET_TO_COME, page_cache_from_env
+from stages import PARSE_WORKERS, BackgroundWriter, StageStats, counted, parse_in_pool, print_stage_stats
 
 # useragent headers
 headers = {
@@ -40,209 +17,199 @@ headers = {
                   '(KHTML, like Gecko) Chrome/86.0.4240.183 Safari/537.36'
 }
 
-# Function to get detail after label in fight details table
-def get_detail(fight_detail):
-    texts = list(fight_detail.stripped_strings)
-    if len(texts) >= 2:
-        return texts[-1]
-    elif len(texts) == 1:
-        return texts[0]
-    else:
-        return ''
-
-# scrape each event
-for link in tqdm(event_links):
-    fights_found = 0  # Initialize fights found for this event
-    try:
-        response = requests.get(link, headers=headers)
-        print(f"Processing {link} - Status Code: {response.status_code}")
-        if response.status_code != 200:
-            print(f"Failed to retrieve {link}")
-            empty_page.append(link)
+# fetch concurrency and the request rate toward sherdog.com
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 8))
+REQUESTS_PER_SECOND = float(os.environ.get('REQUESTS_PER_SECOND', 4))
+
+# fights are upserted by fight_key every FLUSH_EVENTS events in requests of at most WRITE_BATCH_SIZE
+# rows, the checkpoint at FIGHTS_CHECKPOINT lets an interrupted crawl resume after the last flush
+FLUSH_EVENTS = int(os.environ.get('FLUSH_EVENTS', 25))
+FIGHTS_CHECKPOINT = os.environ.get('FIGHTS_CHECKPOINT', '.fights_checkpoint')
+WRITE_BATCH_SIZE = 1000
+
+
+def read_event_links(supabase):
+    response = supabase.table('event_links').select('link').execute()
+    return [item['link'] for item in response.data]
+
+
+def iter_event_fights(event_links, stats=None):
+    # yields (link, status, fights) per event in link order, status 'fights', 'yet_to_come' or 'empty'.
+    # Pages are fetched on FETCH_WORKERS threads and parsed on PARSE_WORKERS processes while the
+    # caller handles earlier events; the fetch and parse StageStats are appended to stats if given
+    # local page cache, PAGE_CACHE=0 disables it, PAGE_CACHE_OFFLINE=1 reparses cached pages without network
+    page_cache = page_cache_from_env()
+    offline = os.environ.get('PAGE_CACHE_OFFLINE') == '1'
+    fetch_stats, parse_stats = StageStats('fetch'), StageStats('parse')
+    if stats is not None:
+        stats.extend([fetch_stats, parse_stats])
+
+    # scrape each event, pages are fetched concurrently but handled in link order
+    pages = fetch_pages(event_links, headers=headers, max_workers=FETCH_WORKERS,
+                        requests_per_second=REQUESTS_PER_SECOND, cache=page_cache, offline=offline)
+
+    def parse_items():
+        # ((link, fetch error or status code), parse arguments or None when there's nothing to parse)
+        for link, response, error in counted(pages, fetch_stats):
+            if error is not None:
+                yield (link, error), None
+                continue
+            print(f"Processing {link} - Status Code: {response.status_code}")
+            yield (link, response.status_code), ((response.text, link) if response.status_code == 200 else None)
+
+    # a process pool isn't worth starting for a handful of pages
+    workers = PARSE_WORKERS if len(event_links) > 4 * PARSE_WORKERS else 1
+    parsed = parse_in_pool(parse_items(), parse_event_page, workers, parse_stats)
+    for (link, fetched), result in tqdm(parsed, total=len(event_links)):
+        error = fetched if isinstance(fetched, Exception) else result if isinstance(result, Exception) else None
+        if error is not None:
+            print(f"Error processing {link}: {error}")
+            yield link, 'empty', []
             continue
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-        event_detail_div = soup.find('div', class_='event_detail')
-        if not event_detail_div:
-            print(f"No event_detail found in {link}")
-            empty_page.append(link)
+        if fetched != 200:
+            print(f"Failed to retrieve {link}")
+            yield link, 'empty', []
             continue
 
-        # get even name
-        event_name_tag = event_detail_div.find('h1')
-        if event_name_tag:
-            event_name = event_name_tag.get_text(separator=" ", strip=True)
-            print(f"Event Name: {event_name}")
-        else:
-            event_name = None
-            print(f"No event name found in {link}")
-
-        # get event date
-        event_date_meta = soup.find('meta', itemprop="startDate")
-        if event_date_meta:
-            event_date = event_date_meta.get('content')
-            print(f"Event Date: {event_date}")
-        else:
-            event_date = None
-            print(f"No event date found in {link}")
-            empty_page.append(link)
+        status, fights = result
+        if status == 'yet_to_come':
+            if page_cache:
+                page_cache.set_ttl(link, TTL_YET_TO_COME)
+            yield link, 'yet_to_come', []
             continue
-
-        # yet to come check
-        if soup.find('span', class_='final_result yet_to_come'):
-            print(f"Results yet to come for {link}")
-            yet_to_come.append(link)
+        if status == 'empty':
+            yield link, 'empty', []
             continue
 
-        # get main event 
-        main_event = soup.find('div', itemprop='subEvent')
-        if main_event:
-            print(f"Found main event in {link}")
+        if page_cache:
+            page_cache.set_ttl(link, TTL_FINAL)  # finished event, never refetched
+        yield link, 'fights', fights
+
+
+def upsert_fights(supabase, fights):
+    # keyed writes, a re-scraped fight rewrites its own row and keeps its id. A key seen twice
+    # in one request would fail the upsert, the later row wins
+    rows = list({fight['fight_key']: {k: v for k, v in fight.items() if k != 'id'} for fight in fights}.values())
+    batch_upsert(supabase, 'mma_fight_results', rows, on_conflict='fight_key', batch_size=WRITE_BATCH_SIZE)
+
+
+def write_event_statuses(supabase, yet_to_come, empty_page):
+    # queued for repoll_events.py, no next_check yet means due on the next run
+    first_seen = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    if yet_to_come:
+        supabase.table('yet_to_come').insert(
+            [{'link': link, 'first_seen': first_seen, 'attempts': 0} for link in yet_to_come]
+        ).execute()
+
+    if empty_page:  # Only proceed if empty_page is not empty
+        supabase.table('empty_event_pages').insert(
+            [{'link': link, 'first_seen': first_seen, 'attempts': 0} for link in empty_page]
+        ).execute()
+
+
+class CrawlCheckpoint:
+    # append-only log next to the crawl, one json line per flush with the links it wrote.
+    # A line torn by a crash is cut off when the log is read back
+    def __init__(self, path=FIGHTS_CHECKPOINT):
+        self.path = path
+        self.done = set()
+        self.resumed = False
+        try:
+            with open(path, 'rb') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        good_bytes = 0
+        for line in lines:
             try:
-                winner = main_event.find('div', class_='fighter left_side')
-                loser = main_event.find('div', class_='fighter right_side')
-
-                if winner and loser:
-                 
-                    winner_name = winner.find('span', itemprop='name').get_text(strip=True)
-                    winner_href = winner.find('a', itemprop='url')['href']
-                    winner_id = get_fighter_id(winner_href)
-                    final_result_tag = winner.find('span', class_='final_result')
-                    final_result = final_result_tag.get_text(strip=True) if final_result_tag else None
-
-                  
-                    loser_name = loser.find('span', itemprop='name').get_text(strip=True)
-                    loser_href = loser.find('a', itemprop='url')['href']
-                    loser_id = get_fighter_id(loser_href)
-
-                    # fight details
-                    fight_details_table = main_event.find('table', class_='fight_card_resume')
-                    if fight_details_table:
-                        fight_details = fight_details_table.find_all('td')
-           
-                        match_number = get_detail(fight_details[0])
-                        winby = get_detail(fight_details[1])
-                        referee_text = get_detail(fight_details[2])
-                        referee_tag = fight_details[2].find('a')
-                        if referee_tag:
-                            referee = referee_tag.get_text(strip=True)
-                        else:
-                            referee = referee_text
-                        round_ = get_detail(fight_details[3])
-                 
-
-                        fight_id = len(results_list) + 1  # unique ascending fight id
-
-                        # appending main event
-                        results_list.append({
-                            'id': fight_id, 'winner_id': winner_id, 'winner_name': winner_name,
-                            'final_result': final_result, 'loser_name': loser_name, 'loser_id': loser_id,
-                            'event_name': event_name, 'event_date': event_date, 'winby': winby,
-                            'referee': referee if referee != 'N/A' else None, 'round': round_
-                        })
-                        fights_found += 1  # increment fights found
-                        print(f"Added main event: {winner_name} vs {loser_name}")
-                    else:
-                        print(f"Fight details table not found in main event in {link}")
-                else:
-                    print(f"Main event fighters not found in {link}")
-            except Exception as e:
-                print(f"Error parsing main event in {link}: {e}")
-        else:
-            print(f"No main event found in {link}")
-
-        # scrape other fights
-        fight_rows = soup.select('table.new_table.result tr[itemprop="subEvent"]')
-        print(f"Found {len(fight_rows)} fights in {link}")
-
-        for fight in fight_rows:
-            try:
-                cols = fight.find_all('td')
-                if len(cols) < 7:
-                    print(f"Skipping fight due to insufficient columns in {link}")
-                    continue  # skip if columns are missing
-
-                match_number = cols[0].get_text(strip=True)
-                winner_col = cols[1]
-                loser_col = cols[3]
-                winby_col = cols[4]
-                round_col = cols[5]
-                # time_col = cols[6]
-
-                # winner details
-                winner_tag = winner_col.find('a', itemprop='url')
-                if winner_tag:
-                    winner_name = winner_col.find('span', itemprop='name').get_text(separator=' ', strip=True)
-                    winner_href = winner_tag['href']
-                    winner_id = get_fighter_id(winner_href)
-                    final_result = winner_col.find('span', class_='final_result').get_text(strip=True)
-                else:
-                    print(f"Missing winner info in fight {match_number} in {link}")
-                    continue  # skip if winner info is missing
-
-                # Loser details
-                loser_tag = loser_col.find('a', itemprop='url')
-                if loser_tag:
-                    loser_name = loser_col.find('span', itemprop='name').get_text(separator=' ', strip=True)
-                    loser_href = loser_tag['href']
-                    loser_id = get_fighter_id(loser_href)
-                else:
-                    print(f"Missing loser info in fight {match_number} in {link}")
-                    continue  # skip if loser info is missing
-
-                # method and referee
-                winby_text_tag = winby_col.find('b')
-                if winby_text_tag:
-                    winby_text = winby_text_tag.get_text(strip=True)
-                else:
-                    winby_text = winby_col.get_text(strip=True).strip()
-                referee_tag = winby_col.find('a')
-                if referee_tag:
-                    referee = referee_tag.get_text(strip=True)
-                else:
-                    referee_span = winby_col.find('span', class_='sub_line')
-                    referee = referee_span.get_text(strip=True) if referee_span else None
-
-                # round
-                round_ = round_col.get_text(strip=True)
-
-
-                fight_id = len(results_list) + 1  # fight id 
-
-                # appending non-main event 
-                results_list.append({
-                    'id': fight_id, 'winner_id': winner_id, 'winner_name': winner_name,
-                    'final_result': final_result, 'loser_name': loser_name, 'loser_id': loser_id,
-                    'event_name': event_name, 'event_date': event_date, 'winby': winby_text,
-                    'referee': referee if referee != 'N/A' else None, 'round': round_
-                })
-                fights_found += 1  # increment fights found
-                print(f"Added fight {match_number}: {winner_name} vs {loser_name}")
-            except Exception as e:
-                print(f"Error parsing fight {match_number} in {link}: {e}")
-                continue
-
-        # after processing both main event and other fights
-        if fights_found == 0:
-            print(f"No fights found in {link}")
-            empty_page.append(link)
-
-    except Exception as e:
-        print(f"Error processing {link}: {e}")
-        empty_page.append(link)
-        continue
-
-
-results_df = pd.DataFrame(results_list, columns=columns)
-
-supabase.table('mma_fight_results').delete().neq('id', 0).execute()
-data = results_df.to_dict(orient='records')
-supabase.table('mma_fight_results').insert(data).execute()
-
-supabase.table('yet_to_come').insert([{'link': link} for link in yet_to_come]).execute()
-
-if empty_page:  # Only proceed if empty_page is not empty
-    supabase.table('empty_event_pages').insert([{'link': link} for link in empty_page]).execute()
-
- 
-print("Run Finished")
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b'\n'):
+                break
+            self.done.update(entry['links'])
+            self.resumed = True
+            good_bytes += len(line)
+        with open(path, 'r+b') as f:
+            f.truncate(good_bytes)
+
+    def record(self, links):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'links': links}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(links)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def write_crawl_batch(supabase, checkpoint, links, fights, yet_to_come, empty_page):
+    if fights:
+        upsert_fights(supabase, fights)
+    if checkpoint.resumed:
+        # a crashed flush may have written these links already
+        for table, table_links in [('yet_to_come', yet_to_come), ('empty_event_pages', empty_page)]:
+            if table_links:
+                supabase.table(table).delete().in_('link', table_links).execute()
+    write_event_statuses(supabase, yet_to_come, empty_page)
+    checkpoint.record(links)
+
+
+def crawl_fights(supabase, event_links, checkpoint, flush_events=FLUSH_EVENTS):
+    # scrapes and upserts mma_fight_results every flush_events events. Batches are written on a
+    # background thread while the next ones are fetched and parsed, a few batches at most are held.
+    # A resumed crawl skips the links in the checkpoint, rewriting a flush that crashed is harmless
+    if checkpoint.resumed:
+        print(f"Resuming crawl: {len(checkpoint.done)} events already written")
+    else:
+        # rows from before fights had keys, every crawl used to replace the whole table
+        supabase.table('mma_fight_results').delete().is_('fight_key', 'null').execute()
+
+    event_links = [link for link in event_links if link not in checkpoint.done]
+    batch_links, batch_fights, yet_to_come, empty_page = [], [], [], []
+    written = 0
+    stats = []
+    start = time.perf_counter()
+
+    with BackgroundWriter() as writer:
+        def flush():
+            writer.submit(write_crawl_batch, supabase, checkpoint, list(batch_links), list(batch_fights),
+                          list(yet_to_come), list(empty_page), items=len(batch_links))
+            for batch in (batch_links, batch_fights, yet_to_come, empty_page):
+                batch.clear()
+
+        for link, status, fights in iter_event_fights(event_links, stats):
+            batch_links.append(link)
+            if status == 'yet_to_come':
+                yet_to_come.append(link)
+            elif status == 'empty':
+                empty_page.append(link)
+            batch_fights.extend(fights)
+            written += len(fights)
+            if len(batch_links) >= flush_events:
+                flush()
+        if batch_links:
+            flush()
+
+    checkpoint.clear()
+    print_stage_stats(stats + [writer.stats], time.perf_counter() - start)
+    return written
+
+
+def main():
+    supabase = get_client()
+
+    # read links from database
+    event_links = read_event_links(supabase)
+
+    written = crawl_fights(supabase, event_links, CrawlCheckpoint())
+    print(f"Wrote {written} fights")
+    get_http_client().print_stats()
+
+    print("Run Finished")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
-import requests
 from bs4 import BeautifulSoup
+import argparse
 import os
-from supabase import create_client, Client
+import sys
+from datetime import date, datetime
+from storage import get_client
+from fetcher import fetch_pages
+from http_client import get_http_client
+from page_cache import TTL_LISTING, cached_get, page_cache_from_env
 
+EVENTS_URL = 'https://www.sherdog.com/events/'
+
+# listing pages walked back looking for the marker event (or for a date range), fetched
+# LISTING_WORKERS at a time within the REQUESTS_PER_SECOND limit toward sherdog.com
+EVENT_LISTING_PAGES = int(os.environ.get('EVENT_LISTING_PAGES', 200))
+LISTING_WORKERS = int(os.environ.get('LISTING_WORKERS', 2))
+REQUESTS_PER_SECOND = float(os.environ.get('REQUESTS_PER_SECOND', 4))
 
-SUPABASE_URL = os.environ.get('SUPABASE_URL')
-SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 def extract_event_info(row):
     event_info = {}
@@ -34,67 +43,116 @@ def extract_event_info(row):
 
     return event_info
 
-def scrape_events(url, month, day, year, name, headers):
-    event_found = False
-    event_links = []
-
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        print(f"Failed to fetch page {url}")
-        return False, [], None
+def listing_url(page):
+    # page 1 is the main events page, older events are on /events/recent/N-page
+    return EVENTS_URL if page == 1 else f"{EVENTS_URL}recent/{page}-page"
 
-    soup = BeautifulSoup(response.content, 'html.parser')
+def parse_listing(html, url):
+    # event infos on a listing page, newest first, [] when there is no events table
+    soup = BeautifulSoup(html, 'html.parser')
 
-    # on the main events page, the table is under div with id 'recentfights_tab'
-    if 'sherdog.com/events/' in url:
+    if url == EVENTS_URL:
+        # on the main events page the table is under div with id 'recentfights_tab', next to the upcoming events
         events_div = soup.find('div', class_='single_tab', id='recentfights_tab')
         if not events_div:
-            print("No events div found on main events page")
-            return False, [], None
+            print(f"No events div found on {url}")
+            return []
         events_table = events_div.find('table', class_='new_table event')
     else:
         events_table = soup.find('table', class_='new_table event')
-
     if not events_table:
-        print("No events table found")
-        return False, [], None
+        print(f"No events table found on {url}")
+        return []
 
     event_rows = events_table.find_all('tr', onclick=True)
-
     if not event_rows:
-        print("No event rows found")
-        return False, [], None
+        print(f"No event rows found on {url}")
+        return []
 
-    latest_event = None
-    for idx, row in enumerate(event_rows):
-        event_info = extract_event_info(row)
-        if latest_event is None and 'sherdog.com/events/' in url:
-            latest_event = event_info  # update the latest event with the first event from the main page
+    return [extract_event_info(row) for row in event_rows]
 
-        # check if this is the matching event
-        if (event_info['month'] == month and
+def is_marker(event_info, month, day, year, name):
+    return (event_info['month'] == month and
             event_info['day'] == day and
             event_info['year'] == year and
-            event_info['name'] == name):
+            event_info['name'] == name)
+
+def scrape_events(url, month, day, year, name, headers, cache=None):
+    event_found = False
+    event_links = []
+
+    response = cached_get(cache, url, headers=headers, ttl=TTL_LISTING)
+    if response.status_code != 200:
+        print(f"Failed to fetch page {url}")
+        return False, [], None
+
+    events = parse_listing(response.content, url)
+    if not events:
+        return False, [], None
+
+    latest_event = events[0] if url == EVENTS_URL else None
+    for event_info in events:
+        # check if this is the matching event
+        if is_marker(event_info, month, day, year, name):
             event_found = True
             break  # stop processing
-        else:
-            # collect the event link
-            event_links.append(event_info['link'])
+        # collect the event link
+        event_links.append(event_info['link'])
 
     return event_found, event_links, latest_event
 
-def read_initial_variables():
+def iter_listing_pages(pages, cache=None):
+    # yields (page, events) in page order, later pages are fetched ahead on LISTING_WORKERS threads
+    # (at most twice that many in flight); stops at the first page that fails or lists no events
+    urls = [listing_url(page) for page in pages]
+    fetched = fetch_pages(urls, headers=headers, max_workers=LISTING_WORKERS,
+                          requests_per_second=REQUESTS_PER_SECOND, cache=cache, ttl=TTL_LISTING)
+    try:
+        for page, (url, response, error) in zip(pages, fetched):
+            if error is not None or response.status_code != 200:
+                print(f"Failed to fetch page {url}: {error or response.status_code}")
+                return
+            events = parse_listing(response.content, url)
+            if not events:
+                return
+            yield page, events
+    finally:
+        fetched.close()
+
+def event_date(event_info):
+    # month is abbreviated ('Dec'), only its first three letters are read
+    return datetime.strptime(f"{event_info['month'][:3]} {event_info['day']} {event_info['year']}", '%b %d %Y').date()
+
+def collect_event_links_between(since, until=None, max_pages=None, cache=None):
+    # backfill: links of the events dated since..until (inclusive, until defaults to today), oldest first.
+    # The listing is newest first, the walk stops at the first page that reaches back before since
+    max_pages = max_pages or EVENT_LISTING_PAGES
+    event_links = []
+    for page, events in iter_listing_pages(range(1, max_pages + 1), cache):
+        dates = [event_date(event_info) for event_info in events]
+        event_links.extend(
+            event_info['link'] for event_info, date in zip(events, dates)
+            if date >= since and (until is None or date <= until)
+        )
+        print(f"Listing page {page}: {dates[0]} to {dates[-1]}, {len(event_links)} events in range")
+        if dates[-1] < since:
+            break
+    else:
+        print(f"Warning: the listing ended before reaching {since}.")
+    # pages shift while new events are listed, an event can show up at the end of one page and the start of the next
+    return list(dict.fromkeys(reversed(event_links)))
+
+def read_initial_variables(supabase):
     response = supabase.table('initial_variables').select('*').execute()
     variables = response.data[0]  # Assuming there's at least one row
     return variables
 
-def write_event_links(links):
+def write_event_links(supabase, links):
     supabase.table('event_links').delete().neq('id', 0).execute()
     data = [{'link': link} for link in links]
     supabase.table('event_links').insert(data).execute()
 
-def write_initial_variables(latest_event):
+def write_initial_variables(supabase, latest_event):
     supabase.table('initial_variables').update({
         'month': latest_event['month'],
         'day': latest_event['day'],
@@ -102,20 +160,6 @@ def write_initial_variables(latest_event):
         'name': latest_event['name']
     }).eq('id', 1).execute()
 
-#read initial variables from Supabase
-variables = read_initial_variables()
-
-
-month = variables.get('month')
-day = variables.get('day')
-year = variables.get('year')
-name = variables.get('name')
-
-if not all([month, day, year, name]):
-    print("Error: One or more initial variables are missing.")
-    print(f"Please ensure the 'initial_variables' table contains month, day, year, and name.")
-    exit(1)
-
 # user agent header
 headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) ' +
@@ -123,58 +167,112 @@ headers = {
                   'Chrome/115.0.0.0 Safari/537.36'
 }
 
-# initialize variables
-event_links = []
-latest_event = None
+def collect_event_links(supabase, max_pages=None):
+    # returns the new event links (oldest first) and the latest event on the main events page,
+    # walking back up to max_pages listing pages (EVENT_LISTING_PAGES) for the marker event
+    #read initial variables from Supabase
+    variables = read_initial_variables(supabase)
+
 
-# step1 check the main events page
-url_main = 'https://www.sherdog.com/events/'
-print(f"Processing main events page: {url_main}")
-event_found_main, event_links_main, latest_event_main = scrape_events(url_main, month, day, year, name, headers)
+    month = variables.get('month')
+    day = variables.get('day')
+    year = variables.get('year')
+    name = variables.get('name')
 
-if latest_event_main:
-    latest_event = latest_event_main
+    if not all([month, day, year, name]):
+        print("Error: One or more initial variables are missing.")
+        print(f"Please ensure the 'initial_variables' table contains month, day, year, and name.")
+        sys.exit(1)
 
-event_links.extend(event_links_main)
+    # local page cache, PAGE_CACHE=0 disables it
+    page_cache = page_cache_from_env()
 
-if event_found_main:
-    print("Event found on main events page.")
-else:
-    print("Event not found on main events page.")
-    # proceed to page 2
-    url_page2 = 'https://www.sherdog.com/events/recent/2-page'
-    print(f"Processing URL: {url_page2}")
-    event_found_page2, event_links_page2, _ = scrape_events(url_page2, month, day, year, name, headers)
+    # initialize variables
+    event_links = []
 
-    event_links.extend(event_links_page2)
+    # step1 check the main events page
+    print(f"Processing main events page: {EVENTS_URL}")
+    event_found, event_links_main, latest_event = scrape_events(EVENTS_URL, month, day, year, name, headers, page_cache)
+    event_links.extend(event_links_main)
 
-    if event_found_page2:
-        print("Event found on page 2.")
+    if event_found:
+        print("Event found on main events page.")
+    else:
+        # walk the older listing pages until the event turns up, a few pages are fetched ahead
+        print("Event not found on main events page.")
+        max_pages = max_pages or EVENT_LISTING_PAGES
+        page = 1
+        for page, events in iter_listing_pages(range(2, max_pages + 1), page_cache):
+            print(f"Processing URL: {listing_url(page)}")
+            for event_info in events:
+                if is_marker(event_info, month, day, year, name):
+                    event_found = True
+                    break
+                event_links.append(event_info['link'])
+            if event_found:
+                print(f"Event found on page {page}.")
+                break
+
+        if not event_found:
+            # nothing is written and the marker stays, otherwise the next crawl would cover most of the site
+            print(f"Error: Specified event '{name}' ({year}-{month}-{day}) not found in {page} listing pages.")
+            print("Check initial_variables (the event may have been renamed), or collect the missed events "
+                  "with get_links.py --since YYYY-MM-DD, which also moves the marker to the newest event.")
+            sys.exit(1)
+
+    if event_links:
+        # reverse the list to have events from oldest to newest, once each
+        event_links = list(dict.fromkeys(reversed(event_links)))
+        print("\nEvent links:")
+        for link in event_links:
+            print(link)
+
+    return event_links, latest_event
+
+def save_latest_event(supabase, latest_event):
+    if latest_event:
+        print("\nUpdated initial variables:")
+        print(f"month: {latest_event['month']}")
+        print(f"day: {latest_event['day']}")
+        print(f"year: {latest_event['year']}")
+        print(f"name: {latest_event['name']}")
+
+        # Update initial variables in Supabase
+        write_initial_variables(supabase, latest_event)
+    else:
+        print("No latest event found")
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect new event links into event_links.")
+    parser.add_argument('--max-pages', type=int, default=None,
+                        help=f"listing pages to walk back at most (default {EVENT_LISTING_PAGES})")
+    parser.add_argument('--since', type=date.fromisoformat, default=None,
+                        help="backfill: collect every event from this date (YYYY-MM-DD) instead of since the marker")
+    parser.add_argument('--until', type=date.fromisoformat, default=None,
+                        help="backfill: last event date to collect, the marker is left alone when set")
+    args = parser.parse_args()
+
+    supabase = get_client()
+
+    if args.since:
+        page_cache = page_cache_from_env()
+        event_links = collect_event_links_between(args.since, args.until, args.max_pages, page_cache)
+        latest_event = None
+        if args.until is None:
+            # the marker moves to the newest event so regular runs carry on from there
+            _, _, latest_event = scrape_events(EVENTS_URL, None, None, None, None, headers, page_cache)
     else:
-        print("Event not found on page 2.")
-        print("Error: Specified event not found.")
-
-if event_links:
-    # reverse the list to have events from oldest to newest
-    event_links.reverse()
-    print("\nEvent links:")
-    for link in event_links:
-        print(link)
-
-    # write event links to Supabase
-    write_event_links(event_links)
-    print(f"\nEvent links have been written to Supabase 'event_links' table.")
-else:
-    print("No new events found")
-
-if latest_event:
-    print("\nUpdated initial variables:")
-    print(f"month: {latest_event['month']}")
-    print(f"day: {latest_event['day']}")
-    print(f"year: {latest_event['year']}")
-    print(f"name: {latest_event['name']}")
-
-    # Update initial variables in Supabase
-    write_initial_variables(latest_event)
-else:
-    print("No latest event found")
\ No newline at end of file
+        event_links, latest_event = collect_event_links(supabase, args.max_pages)
+
+    if event_links:
+        # write event links to Supabase
+        write_event_links(supabase, event_links)
+        print(f"\nEvent links have been written to Supabase 'event_links' table.")
+    else:
+        print("No new events found")
+
+    save_latest_event(supabase, latest_event)
+    get_http_client().print_stats()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import email.utils
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared HTTP transport of the scrapers: one requests.Session, so connections to a host are kept
+# alive and pooled, with connect/read timeouts on every request and retries of 429, 5xx and
+# connection errors with jittered exponential backoff (or the server's Retry-After).
+# Per-host request counts and latency are kept for the end of run report.
+#
+# HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT in seconds, HTTP_RETRIES retries per request,
+# HTTP_BACKOFF the first retry delay, doubled per retry up to HTTP_MAX_BACKOFF.
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 4))
+HTTP_BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.5))
+HTTP_MAX_BACKOFF = float(os.environ.get('HTTP_MAX_BACKOFF', 60))
+POOL_SIZE = 16  # connections kept per host, at least the number of fetch workers
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def retry_after_seconds(value):
+    # Retry-After is either delay seconds or an HTTP date, None when missing or unreadable
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    def __init__(self, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT, retries=HTTP_RETRIES,
+                 backoff=HTTP_BACKOFF, max_backoff=HTTP_MAX_BACKOFF, pool_size=POOL_SIZE):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.lock = threading.Lock()
+        self.host_stats = {}
+
+    def _record(self, host, seconds, response=None, retried=False):
+        with self.lock:
+            stats = self.host_stats.setdefault(host, {
+                'requests': 0, 'retries': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+            })
+            stats['requests'] += 1
+            stats['retries'] += retried
+            stats['errors'] += response is None or response.status_code >= 400
+            stats['bytes'] += len(response.content) if response is not None else 0
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def _delay(self, attempt, response=None):
+        delay = None
+        if response is not None:
+            delay = retry_after_seconds(response.headers.get('Retry-After'))
+        if delay is None:
+            delay = random.uniform(0, self.backoff * 2 ** attempt)  # full jitter
+        return min(delay, self.max_backoff)
+
+    def get(self, url, headers=None, timeout=None, before_request=None, **kwargs):
+        # before_request(url) runs ahead of every attempt, retries included (rate limiting).
+        # After the last retry a 429/5xx response is returned as is, a connection error raised
+        host = urlparse(url).netloc
+        for attempt in range(self.retries + 1):
+            if before_request is not None:
+                before_request(url)
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, timeout=timeout or self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(host, time.perf_counter() - start, retried=attempt > 0)
+                if attempt == self.retries:
+                    raise
+                time.sleep(self._delay(attempt))
+                continue
+            self._record(host, time.perf_counter() - start, response, retried=attempt > 0)
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return response
+            print(f"{response.status_code} from {url}, retrying ({attempt + 1}/{self.retries})")
+            time.sleep(self._delay(attempt, response))
+
+    def print_stats(self):
+        with self.lock:
+            host_stats = {host: dict(stats) for host, stats in self.host_stats.items()}
+        if not host_stats:
+            return
+        print("\n--- HTTP requests per host ---")
+        for host, stats in sorted(host_stats.items()):
+            average = stats['seconds'] / stats['requests']
+            print(f"  {host:<28} {stats['requests']:6d} requests {stats['retries']:4d} retries "
+                  f"{stats['errors']:4d} errors {stats['bytes'] / 1024 / 1024:8.1f} MiB "
+                  f"avg {average * 1000:6.0f} ms max {stats['max_seconds'] * 1000:6.0f} ms")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    # the process-wide client, created on first use
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def http_get(url, **kwargs):
+    return get_http_client().get(url, **kwargs)
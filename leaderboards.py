@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from db_utils import batch_upsert, diff_rows, read_table, to_records
+from elo_engine import NO_DAY, VARIANTS, to_days
+
+# rank_elo / rank_elo_dom rank every fighter by current rating, class_rank_elo / class_rank_elo_dom
+# within the fighter's weight_class (fighters with an unknown weight class only get the overall rank).
+# Ties share a rank (1, 2, 2, 4). Every board is one sort of its fighters per run.
+#
+# Ranks live in their own table, fighter_ranks, one row per fighter. One fight moves everyone rated
+# below the fighters in it, so keeping them out of fighters_enriched_new keeps that table's writes
+# down to the fighters who fought; only the rank rows that changed are upserted.
+#
+# RANK_ACTIVE_DAYS=730 only ranks fighters whose last fight is at most that many days before the
+# latest fight on record, everyone else gets no rank.
+
+RANK_ACTIVE_DAYS = os.environ.get('RANK_ACTIVE_DAYS')
+RANK_TABLE = 'fighter_ranks'
+RANK_COLUMNS = [
+    column for variant in VARIANTS.values() for column in [variant['rank_column'], variant['class_rank_column']]
+]
+UNKNOWN_WEIGHT_CLASSES = {None, '', 'unknown'}
+
+
+def active_fighters(last_fight_dates, active_days):
+    # fighters whose last fight is within active_days of the latest fight on record
+    days = to_days(last_fight_dates)
+    known = days != NO_DAY
+    if not known.any():
+        return known
+    return known & (days >= days[known].max() - int(active_days))
+
+
+def _rank_board(ratings):
+    # rank of every fighter on the board, 1 + number of fighters rated strictly higher
+    return np.searchsorted(np.sort(-ratings), -ratings, side='left') + 1
+
+
+def rank_fighters(fighters_df, eligible=None, variants=VARIANTS):
+    # rank columns for every fighter in fighters_df (fighter_id, weight_class and the current rating
+    # columns), Int64 with NA for unranked fighters.
+    # eligible is an optional boolean mask of fighters to rank (activity filters), by default
+    # RANK_ACTIVE_DAYS applied to last_fight_date
+    if eligible is None:
+        eligible = (active_fighters(fighters_df['last_fight_date'], RANK_ACTIVE_DAYS) if RANK_ACTIVE_DAYS
+                    else np.ones(len(fighters_df), dtype=bool))
+    eligible = np.asarray(eligible, dtype=bool)
+    weight_class = fighters_df['weight_class'].astype(object).where(fighters_df['weight_class'].notnull(), None)
+    in_class = eligible & ~weight_class.isin(UNKNOWN_WEIGHT_CLASSES).to_numpy()
+    classes = weight_class.to_numpy()
+
+    ranks = pd.DataFrame({'fighter_id': fighters_df['fighter_id'].to_numpy()})
+    for variant in variants.values():
+        ratings = pd.to_numeric(fighters_df[variant['current_column']], errors='coerce').to_numpy(dtype=float)
+        rated = ~np.isnan(ratings)
+
+        overall = np.full(len(fighters_df), np.nan)
+        members = eligible & rated
+        overall[members] = _rank_board(ratings[members])
+
+        by_class = np.full(len(fighters_df), np.nan)
+        for weight in pd.unique(classes[in_class & rated]):
+            members = in_class & rated & (classes == weight)
+            by_class[members] = _rank_board(ratings[members])
+
+        ranks[variant['rank_column']] = pd.array(overall, dtype='Float64').astype('Int64')
+        ranks[variant['class_rank_column']] = pd.array(by_class, dtype='Float64').astype('Int64')
+    return ranks
+
+
+def read_ranks(client):
+    ranks = read_table(client, RANK_TABLE, ', '.join(['fighter_id'] + RANK_COLUMNS), key='fighter_id',
+                       dtypes={col: 'Int64' for col in RANK_COLUMNS})
+    return ranks.astype({'fighter_id': 'int64'})
+
+
+def write_ranks(client, ranks_df, previous_df=None):
+    # upserts the rows of ranks_df that differ from previous_df (the ranks as stored), all of them
+    # without it; returns the number of rows written
+    changed = ranks_df if previous_df is None else diff_rows(previous_df, ranks_df, 'fighter_id')
+    if len(changed):
+        batch_upsert(client, RANK_TABLE, to_records(changed), on_conflict='fighter_id', batch_size=10000)
+    return len(changed)
@@ -0,0 +1,63 @@
+-- Columns, tables and constraints the pipeline needs on top of the original Supabase tables.
+-- Safe to run more than once: psql -f migrations/001_pipeline_schema.sql "$DATABASE_URL"
+-- or paste it into the Supabase SQL editor. storage.TABLES is the same schema for the SQLite backend.
+
+begin;
+
+-- fighters_enriched_new: peak dates, the rating of the best win and the last fight (calculate_elo.py).
+-- Upserts go on_conflict fighter_id, which needs a unique index; remove duplicate fighter_ids first
+alter table fighters_enriched_new
+    add column if not exists peak_date date,
+    add column if not exists peak_date_dom date,
+    add column if not exists best_win_elo double precision,
+    add column if not exists best_win_elo_dom double precision,
+    add column if not exists last_fight_date date;
+create unique index if not exists fighters_enriched_new_fighter_id_key on fighters_enriched_new (fighter_id);
+
+-- new_fighters logs new fighters with the same fields
+alter table new_fighters
+    add column if not exists peak_date date,
+    add column if not exists peak_date_dom date,
+    add column if not exists best_win_elo double precision,
+    add column if not exists best_win_elo_dom double precision,
+    add column if not exists last_fight_date date;
+
+-- overall and weight class ranks, one row per fighter (leaderboards.py)
+create table if not exists fighter_ranks (
+    id bigint generated by default as identity primary key,
+    fighter_id bigint not null unique,
+    rank_elo integer,
+    rank_elo_dom integer,
+    class_rank_elo integer,
+    class_rank_elo_dom integer
+);
+
+-- mma_fight_results keeps its rows between crawls: fights are upserted on fight_key and stamped
+-- with rated_at once calculate_elo.py has rated them. Rows from before fight keys stay null
+alter table mma_fight_results
+    add column if not exists fight_key text,
+    add column if not exists rated_at text;
+create unique index if not exists mma_fight_results_fight_key_key on mma_fight_results (fight_key);
+create index if not exists mma_fight_results_unrated_idx on mma_fight_results (id) where rated_at is null;
+
+-- the raw tables carry the fight_key of every rated fight. Not unique: replay_elo.py --write
+-- inserts the replayed rows before it deletes the old ones
+alter table fighters_regular_raw add column if not exists fight_key text;
+alter table fighters_dom_raw add column if not exists fight_key text;
+create index if not exists fighters_regular_raw_fight_key_idx on fighters_regular_raw (fight_key);
+create index if not exists fighters_dom_raw_fight_key_idx on fighters_dom_raw (fight_key);
+
+-- re-check schedule of event pages without results (repoll_events.py), utc times as
+-- 'YYYY-MM-DDTHH:MM:SS' text, which compares in time order
+alter table yet_to_come
+    add column if not exists first_seen text,
+    add column if not exists last_checked text,
+    add column if not exists next_check text,
+    add column if not exists attempts integer default 0;
+alter table empty_event_pages
+    add column if not exists first_seen text,
+    add column if not exists last_checked text,
+    add column if not exists next_check text,
+    add column if not exists attempts integer default 0;
+
+commit;
@@ -0,0 +1,22 @@
+-- fighters_enriched_new.updated_at, set on every insert and update. calculate_elo.py's local
+-- snapshot records the row count and the latest updated_at and is dropped once either moves,
+-- whichever tool or manual edit wrote the table (ratings_snapshot.py).
+
+begin;
+
+alter table fighters_enriched_new add column if not exists updated_at timestamptz not null default now();
+create index if not exists fighters_enriched_new_updated_at_idx on fighters_enriched_new (updated_at);
+
+create or replace function set_updated_at() returns trigger language plpgsql as $$
+begin
+    new.updated_at = clock_timestamp();
+    return new;
+end
+$$;
+
+drop trigger if exists fighters_enriched_new_updated_at on fighters_enriched_new;
+create trigger fighters_enriched_new_updated_at
+    before update on fighters_enriched_new
+    for each row execute function set_updated_at();
+
+commit;
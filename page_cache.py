@@ -0,0 +1,172 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+from http_client import http_get
+
+# ttl classes in seconds, None never expires
+TTL_FINAL = None          # finished events
+TTL_YET_TO_COME = 6 * 3600
+TTL_LISTING = 3600        # event listing pages
+TTL_DEFAULT = 24 * 3600   # pages not classified yet
+
+DEFAULT_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', '.page_cache')
+DEFAULT_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_MB', 2048)) * 1024 * 1024
+
+
+class CachedResponse:
+    # the subset of requests.Response the scrapers use
+    def __init__(self, url, status_code, content, encoding, headers=None, from_cache=True):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+        self.headers = headers or {}
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}")
+
+
+class PageCache:
+    # content-addressed page store: bodies are files named by the sha256 of the url,
+    # validators, ttl and lru bookkeeping live in a small sqlite index next to them
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                encoding TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                ttl REAL,
+                size INTEGER NOT NULL
+            )
+        ''')
+        self.db.commit()
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def lookup(self, url):
+        # returns (response, is_fresh, validators) or None when the url isn't cached
+        key = self._key(url)
+        with self.lock:
+            row = self.db.execute(
+                'SELECT encoding, etag, last_modified, fetched_at, ttl FROM pages WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            encoding, etag, last_modified, fetched_at, ttl = row
+            try:
+                with open(self._path(key), 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                self.db.execute('DELETE FROM pages WHERE key = ?', (key,))
+                self.db.commit()
+                return None
+            self.db.execute('UPDATE pages SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.db.commit()
+        is_fresh = ttl is None or time.time() - fetched_at < ttl
+        validators = {}
+        if etag:
+            validators['If-None-Match'] = etag
+        if last_modified:
+            validators['If-Modified-Since'] = last_modified
+        return CachedResponse(url, 200, content, encoding), is_fresh, validators
+
+    def store(self, url, response, ttl=TTL_DEFAULT):
+        key = self._key(url)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        content = response.content
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, url, response.encoding or getattr(response, 'apparent_encoding', None),
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                 now, now, ttl, len(content))
+            )
+            self.db.commit()
+            self._evict()
+
+    def touch(self, url):
+        # a 304 revalidation: the stored copy is current again
+        with self.lock:
+            self.db.execute('UPDATE pages SET fetched_at = ? WHERE key = ?', (time.time(), self._key(url)))
+            self.db.commit()
+
+    def set_ttl(self, url, ttl):
+        # reclassify a page once it has been parsed, e.g. a finished event never expires
+        with self.lock:
+            self.db.execute('UPDATE pages SET ttl = ? WHERE key = ?', (ttl, self._key(url)))
+            self.db.commit()
+
+    def _evict(self):
+        # least recently used pages go first until the cache fits max_bytes again
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute('SELECT key, size FROM pages ORDER BY last_used').fetchall():
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self.db.execute('DELETE FROM pages WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self.db.commit()
+
+
+def page_cache_from_env():
+    # the scrapers' page cache, None when PAGE_CACHE=0 disables it
+    return PageCache() if os.environ.get('PAGE_CACHE', '1') != '0' else None
+
+
+def cached_get(cache, url, headers=None, timeout=None, ttl=TTL_DEFAULT, offline=False, get=http_get):
+    # serve from disk while fresh, revalidate with ETag/Last-Modified once stale.
+    # offline=True serves any cached copy without touching the network.
+    # timeout None keeps the http client's connect/read timeouts
+    if cache is None:
+        return get(url, headers=headers, timeout=timeout)
+
+    cached = cache.lookup(url)
+    if cached is not None:
+        response, is_fresh, validators = cached
+        if is_fresh or offline:
+            return response
+        response_new = get(url, headers={**(headers or {}), **validators}, timeout=timeout)
+        if response_new.status_code == 304:
+            cache.touch(url)
+            return response
+    else:
+        response_new = get(url, headers=headers, timeout=timeout)
+
+    if response_new.status_code == 200:
+        cache.store(url, response_new, ttl=ttl)
+    return response_new
@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+
+from db_utils import read_table
+from elo_engine import NO_DAY, VARIANTS, parse_fighter_ids, to_days
+
+# Point-in-time rating index built from the raw results: every fight adds one point
+# (day, rating after the fight) for the winner and one for the loser. Points are stored
+# contiguously, sorted by fighter then day, with offsets[i]:offsets[i + 1] being fighter i's
+# slice (CSR layout), so an as-of query is a binary search instead of a scan of the raw tables.
+#
+#   history = RatingHistory.from_raw(raw_frames)
+#   history.rating_at(2245, '2019-03-02')                             # after that day's fights
+#   history.lookup(winner_ids, event_dates, before=True)              # going into the fights
+#
+# calculate_elo.py keeps a saved index at RATING_HISTORY_PATH up to date by extending it with
+# each run's fights; the first run (or a missing file) builds it from the raw tables.
+
+DAY_BIAS = 2 ** 31  # days are shifted into the low 32 bits of the (fighter, day) search key
+
+
+class RatingHistory:
+    def __init__(self, fighter_ids, offsets, days, ratings, start, variants=VARIANTS):
+        # fighter_ids: (n_fighters,) int64, offsets: (n_fighters + 1,), days: (n_points,) days since epoch,
+        # ratings: (n_points, n_variants) after each fight, start: (n_fighters, n_variants) rating going
+        # into the fighter's first fight
+        self.variants = list(variants)
+        self.fighter_ids = np.asarray(fighter_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.days = np.asarray(days, dtype=np.int64)
+        self.ratings = np.asarray(ratings, dtype=float).reshape(len(self.days), len(self.variants))
+        self.start = np.asarray(start, dtype=float).reshape(len(self.fighter_ids), len(self.variants))
+        self._index = pd.Index(self.fighter_ids)
+        point_codes = np.repeat(np.arange(len(self.fighter_ids), dtype=np.int64), np.diff(self.offsets))
+        self._keys = (point_codes << 32) | (self.days + DAY_BIAS)
+
+    def __len__(self):
+        return len(self.days)
+
+    @staticmethod
+    def _points(winner_ids, loser_ids, days, elo_columns):
+        # one point per fighter and fight, in fight order (winner first), fights without a date dropped
+        days = np.asarray(days, dtype=np.int64)
+        dated = days != NO_DAY
+        ids = np.concatenate([
+            np.asarray(winner_ids, dtype=np.int64)[dated], np.asarray(loser_ids, dtype=np.int64)[dated]
+        ])
+        point_days = np.concatenate([days[dated], days[dated]])
+        after = np.concatenate([elo_columns['winner_elo_after'][dated], elo_columns['loser_elo_after'][dated]])
+        before = np.concatenate([elo_columns['winner_elo_before'][dated], elo_columns['loser_elo_before'][dated]])
+        n = int(dated.sum())
+        order = np.argsort(np.concatenate([np.arange(n) * 2, np.arange(n) * 2 + 1]), kind='stable')
+        return ids[order], point_days[order], after[order], before[order]
+
+    @classmethod
+    def from_fights(cls, winner_ids, loser_ids, days, elo_columns, variants=VARIANTS):
+        # from run_fights output; days as returned by elo_engine.to_days
+        n_variants = len(variants)
+        empty = cls([], [0], [], np.empty((0, n_variants)), np.empty((0, n_variants)), variants)
+        return empty.extend(winner_ids, loser_ids, days, elo_columns)
+
+    @classmethod
+    def from_raw(cls, raw_frames, variants=VARIANTS):
+        # from the raw results tables, {variation: frame} with id, fight_key, winner_id, loser_id,
+        # event_date and the rating columns. Rows of the variations are paired on fight_key, rows
+        # from before fight keys on id; a pair that disagrees on winner, loser or date means the
+        # tables have drifted apart (a partial insert, a manual delete) and raises ValueError
+        names = list(variants)
+        frames = {}
+        for name in names:
+            frame = raw_frames[name]
+            fight_keys = frame['fight_key'] if 'fight_key' in frame.columns else pd.Series(None, index=frame.index)
+            pair_key = fight_keys.astype(object).where(fight_keys.notnull(), 'id:' + frame['id'].astype(str))
+            if pair_key.duplicated().any():
+                raise ValueError(f"{name}: {int(pair_key.duplicated().sum())} fights are stored more than once")
+            frames[name] = frame.assign(pair_key=pair_key.to_numpy()).set_index('pair_key')
+
+        first = frames[names[0]].sort_values('id', kind='mergesort')
+        paired = first.index
+        for name in names[1:]:
+            paired = paired.intersection(frames[name].index, sort=False)
+        unpaired = sum(len(frames[name]) - len(paired) for name in names)
+        if unpaired:
+            print(f"Rating history: skipping {unpaired} raw rows without a counterpart in every variation")
+
+        first = first.loc[paired]
+        first_days = to_days(first['event_date'])
+        for name in names[1:]:
+            other = frames[name].loc[paired]
+            mismatch = (
+                (other['winner_id'].to_numpy() != first['winner_id'].to_numpy())
+                | (other['loser_id'].to_numpy() != first['loser_id'].to_numpy())
+                | (to_days(other['event_date']) != first_days)
+            )
+            if mismatch.any():
+                raise ValueError(f"{int(mismatch.sum())} fights differ in winner, loser or date between "
+                                 f"{names[0]} and {name} raw results, rebuild them with replay_elo.py --write")
+        elo_columns = {
+            col: np.column_stack([
+                pd.to_numeric(frames[name].loc[paired, col]).to_numpy(dtype=float) for name in names
+            ])
+            for col in ['winner_elo_before', 'winner_elo_after', 'loser_elo_before', 'loser_elo_after']
+        }
+        return cls.from_fights(first['winner_id'], first['loser_id'], first_days, elo_columns, variants)
+
+    def extend(self, winner_ids, loser_ids, days, elo_columns):
+        # adds newly rated fights in place (normally later than everything indexed). Existing and
+        # new points are two sorted runs, so the stable merge below is close to linear
+        ids, point_days, after, before = self._points(winner_ids, loser_ids, days, elo_columns)
+        if not len(ids):
+            return self
+
+        # known fighters keep their codes since they come first, new ones are numbered after them
+        n_known = len(self.fighter_ids)
+        all_codes, fighter_ids = pd.factorize(np.concatenate([self.fighter_ids, ids]))
+        n_fighters = len(fighter_ids)
+
+        old_codes = np.repeat(np.arange(n_known, dtype=np.int64), np.diff(self.offsets))
+        codes = np.concatenate([old_codes, all_codes[n_known:].astype(np.int64)])
+        all_days = np.concatenate([self.days, point_days])
+        keys = (codes << 32) | (all_days + DAY_BIAS)
+        order = np.argsort(keys, kind='stable')  # equal keys keep the old points first
+
+        is_new = np.r_[np.zeros(len(self.days), dtype=bool), np.ones(len(ids), dtype=bool)][order]
+        all_before = np.concatenate([np.full((len(self.days), after.shape[1]), np.nan), before])[order]
+        codes = codes[order]
+        offsets = np.searchsorted(codes, np.arange(n_fighters + 1))
+
+        # the start rating comes from the fighter's first point, which may now be a new one
+        start = np.concatenate([self.start, np.full((n_fighters - n_known, after.shape[1]), np.nan)])
+        has_points = offsets[:-1] < offsets[1:]
+        first = offsets[:-1][has_points]
+        replace = is_new[first]
+        start[np.flatnonzero(has_points)[replace]] = all_before[first[replace]]
+
+        self.__init__(fighter_ids, offsets, all_days[order],
+                      np.concatenate([self.ratings, after])[order], start, self.variants)
+        return self
+
+    def lookup(self, fighter_ids, dates, before=False):
+        # ratings as of each (fighter, date) pair, (n_queries, n_variants): after all fights on or
+        # before the date, or with before=True only fights before it (the rating going into a fight
+        # on that date). Fighters without an earlier fight get their start rating, unknown ones NaN
+        fighter_ids = np.asarray(fighter_ids)
+        if fighter_ids.dtype.kind not in 'iu':
+            fighter_ids = parse_fighter_ids(fighter_ids).fillna(-1).to_numpy(dtype=np.int64)  # -1 matches nobody
+        codes = self._index.get_indexer(fighter_ids).astype(np.int64)
+        query_days = to_days(dates)
+        known = (codes >= 0) & (query_days != NO_DAY)
+        keys = (np.where(known, codes, 0) << 32) | (np.where(known, query_days, 0) + DAY_BIAS)
+        pos = np.searchsorted(self._keys, keys, side='left' if before else 'right') - 1
+
+        result = np.full((len(codes), len(self.variants)), np.nan)
+        seg_start = self.offsets[np.where(known, codes, 0)]
+        found = known & (pos >= seg_start)
+        result[found] = self.ratings[pos[found]]
+        unrated = known & ~found
+        result[unrated] = self.start[codes[unrated]]
+        return result
+
+    def rating_at(self, fighter_id, date, variation='normal', before=False):
+        # single query, binary search in the fighter's own slice
+        try:
+            code = self._index.get_loc(int(fighter_id))
+        except (KeyError, TypeError, ValueError):
+            return float('nan')
+        date = pd.Timestamp(date)
+        if pd.isnull(date):
+            return float('nan')
+        v = self.variants.index(variation)
+        lo, hi = self.offsets[code], self.offsets[code + 1]
+        day = date.to_datetime64().astype('datetime64[D]').astype(np.int64)
+        pos = lo + np.searchsorted(self.days[lo:hi], day, side='left' if before else 'right') - 1
+        return float(self.ratings[pos, v]) if pos >= lo else float(self.start[code, v])
+
+    def history(self, fighter_id):
+        # a fighter's full rating history as a frame of dates and one column per variation
+        code = self._index.get_indexer([int(fighter_id)])[0]
+        lo, hi = (self.offsets[code], self.offsets[code + 1]) if code >= 0 else (0, 0)
+        frame = pd.DataFrame(self.ratings[lo:hi], columns=self.variants)
+        frame.insert(0, 'date', self.days[lo:hi].astype('datetime64[D]'))
+        return frame
+
+    def save(self, path):
+        with open(path, 'wb') as f:  # a file object so np.savez doesn't append .npz to the path
+            np.savez(f, fighter_ids=self.fighter_ids, offsets=self.offsets, days=self.days,
+                     ratings=self.ratings, start=self.start, variants=np.asarray(self.variants, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['fighter_ids'], data['offsets'], data['days'], data['ratings'], data['start'],
+                       data['variants'].tolist())
+
+
+RAW_HISTORY_COLUMNS = ('id, fight_key, winner_id, loser_id, event_date, '
+                       'winner_elo_before, winner_elo_after, loser_elo_before, loser_elo_after')
+
+
+def load_rating_history(client, variants=VARIANTS):
+    # full build from the raw results tables
+    raw_frames = {}
+    for name, variant in variants.items():
+        raw_df = read_table(client, variant['raw_table'], RAW_HISTORY_COLUMNS, key='id')
+        raw_df['winner_id'] = parse_fighter_ids(raw_df['winner_id'])
+        raw_df['loser_id'] = parse_fighter_ids(raw_df['loser_id'])
+        raw_frames[name] = raw_df[raw_df['winner_id'].notnull() & raw_df['loser_id'].notnull()]
+    return RatingHistory.from_raw(raw_frames, variants)
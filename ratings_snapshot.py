@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from elo_engine import VARIANTS
+
+# Local copy of the fighter table calculate_elo.py works on, written after every successful run so
+# the next one doesn't have to page fighters_enriched_new over HTTP. One .npy file per column
+# (strings as int32 codes into a categories file, nullable columns with a mask) plus meta.json,
+# plain arrays that load in milliseconds and can be memory-mapped by other readers. The snapshot
+# records a watermark of the tables after its run and is only used while they still match it: the
+# highest id in fighters_regular_raw, the number of fighter rows and their latest updated_at, which
+# a trigger sets on every write (migrations/002_fighter_updated_at.sql). Any other writer, a failed
+# run, replay_elo (--write or --rebuild-best-wins) or a manual edit, moves one of them and the next
+# run reads the remote table again. replay_elo also drops the local snapshot when it writes.
+#
+# ELO_SNAPSHOT=0 turns it off, ELO_SNAPSHOT_DIR moves it. Runs that start from the snapshot still
+# only write back the columns calculate_elo owns for existing fighters.
+
+SNAPSHOT_VERSION = 2
+ELO_SNAPSHOT = os.environ.get('ELO_SNAPSHOT', '1') != '0'
+ELO_SNAPSHOT_DIR = os.environ.get('ELO_SNAPSHOT_DIR', '.elo_snapshot')
+WATERMARK_TABLE = VARIANTS['normal']['raw_table']
+FIGHTER_TABLE = 'fighters_enriched_new'
+
+# the columns calculate_elo computes, everything else in the fighter table belongs to other tools
+RATING_COLUMNS = [
+    column
+    for variant in VARIANTS.values()
+    for column in [
+        variant['current_column'], variant['peak_column'], variant['peak_date_column'], variant['days_peak_column'],
+        variant['best_win_column'], variant['best_win_elo_column'],
+    ]
+] + ['last_fight_date']
+
+
+def table_watermark(client):
+    # [highest fight id in the raw results table, fighter rows, latest fighter updated_at], None for
+    # the values of an empty table. A list so it compares equal to the one read back from meta.json
+    raw = client.table(WATERMARK_TABLE).select('id').order('id', desc=True).limit(1).execute().data
+    fighters = client.table(FIGHTER_TABLE).select('updated_at', count='exact').order(
+        'updated_at', desc=True
+    ).limit(1).execute()
+    return [raw[0]['id'] if raw else None, fighters.count, fighters.data[0]['updated_at'] if fighters.data else None]
+
+
+def save_snapshot(df, watermark, path=ELO_SNAPSHOT_DIR):
+    # written next to the old snapshot and swapped in, a crash leaves the old one or none
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = {}
+    for position, col in enumerate(df.columns):
+        values = df[col]
+        name = f"{position:03d}"
+        dtype = str(values.dtype)
+        if isinstance(values.dtype, pd.CategoricalDtype) or dtype in ('string', 'str', 'object'):
+            categorical = values.astype('category').cat
+            np.save(os.path.join(tmp_path, f"{name}.npy"), categorical.codes.to_numpy(dtype=np.int32))
+            np.save(os.path.join(tmp_path, f"{name}.categories.npy"),
+                    np.asarray(categorical.categories.astype(str), dtype=str))
+        elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+            # nullable integers and floats: the values with NA replaced, and the mask
+            mask = values.isnull().to_numpy()
+            np.save(os.path.join(tmp_path, f"{name}.npy"), values.fillna(0).to_numpy(dtype=values.dtype.numpy_dtype))
+            np.save(os.path.join(tmp_path, f"{name}.mask.npy"), mask)
+        else:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), values.to_numpy())
+        columns[col] = {'file': name, 'dtype': dtype}
+
+    meta = {'version': SNAPSHOT_VERSION, 'watermark': watermark, 'rows': len(df), 'columns': columns}
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def load_snapshot(path=ELO_SNAPSHOT_DIR):
+    # (fighter frame, meta) or None when there is no readable snapshot of this version
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != SNAPSHOT_VERSION:
+        return None
+
+    columns = {}
+    for col, info in meta['columns'].items():
+        base = os.path.join(path, info['file'])
+        values = np.load(f"{base}.npy")
+        dtype = info['dtype']
+        if os.path.exists(f"{base}.categories.npy"):
+            categories = pd.Index(np.load(f"{base}.categories.npy"), dtype='string')
+            values = pd.Categorical.from_codes(values, categories=categories)
+            columns[col] = pd.Series(values) if dtype == 'category' else pd.Series(values).astype(dtype)
+        elif os.path.exists(f"{base}.mask.npy"):
+            columns[col] = pd.Series(pd.array(values, dtype=dtype)).mask(np.load(f"{base}.mask.npy"))
+        else:
+            columns[col] = pd.Series(values, dtype=dtype)
+    return pd.DataFrame(columns), meta
+
+
+def discard_snapshot(path=ELO_SNAPSHOT_DIR):
+    shutil.rmtree(path, ignore_errors=True)
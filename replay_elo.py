@@ -0,0 +1,219 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from storage import get_client
+
+from db_utils import batch_insert, batch_upsert, diff_rows, read_table
+from elo_engine import (
+    VARIANTS, best_win_frame, best_wins_from_raw, build_result_frames, day_strings, index_fighters, initial_best_wins,
+    initial_peaks, initial_ratings, k_factors, last_fight_days, parse_fighter_ids, peak_frame, run_fights_batched,
+    to_days, update_best_wins, update_peaks
+)
+from leaderboards import rank_fighters, read_ranks, write_ranks
+from ratings_snapshot import discard_snapshot
+
+# Recompute every rating, peak and best win from scratch over the full fight history in fighters_regular_raw,
+# in the order calculate_elo.py applied the fights (raw table id, every run inserts its batch in date order),
+# so late results from repoll_events.py come after the newer fights they were rated after.
+# --chronological rates in event date order instead; with --write the raw rows are rewritten in that order.
+# Without --write this only compares the replayed ratings with fighters_enriched_new,
+# which makes it usable as a nightly consistency check (exit code 1 on mismatch).
+# --rebuild-best-wins only recomputes the best wins from the stored raw tables, no replay.
+
+RAW_FIGHT_COLUMNS = '''
+    id,
+    winner_id,
+    winner_name,
+    loser_id,
+    loser_name,
+    event_name,
+    event_date,
+    winby,
+    referee,
+    round,
+    dom,
+    fight_key
+'''
+
+
+def load_raw_fights(client) -> pd.DataFrame:
+    fights_df = read_table(client, 'fighters_regular_raw', RAW_FIGHT_COLUMNS, key='id')
+    print(f"Fetched {len(fights_df)} fights from fighters_regular_raw.")
+    return fights_df
+
+
+def load_raw_results(client) -> dict:
+    # {variation: frame} with the columns best_wins_from_raw needs
+    raw_frames = {}
+    for name, variant in VARIANTS.items():
+        raw_df = read_table(client, variant['raw_table'], 'id, winner_id, loser_name, loser_elo_before, event_date',
+                            key='id', dtypes={'loser_elo_before': 'float64'})
+        raw_df['winner_id'] = parse_fighter_ids(raw_df['winner_id'])
+        raw_frames[name] = raw_df[raw_df['winner_id'].notnull()].astype({'winner_id': 'int64'})
+        print(f"Fetched {len(raw_df)} fights from {variant['raw_table']}.")
+    return raw_frames
+
+
+def load_current_ratings(client) -> pd.DataFrame:
+    current_columns = [variant['current_column'] for variant in VARIANTS.values()]
+    ratings_df = read_table(client, 'fighters_enriched_new', ', '.join(['fighter_id'] + current_columns),
+                            key='fighter_id', dtypes={col: 'float64' for col in current_columns})
+    ratings_df = ratings_df.reindex(columns=['fighter_id'] + current_columns)
+    ratings_df['fighter_id'] = parse_fighter_ids(ratings_df['fighter_id'])
+    return ratings_df[ratings_df['fighter_id'].notnull()].astype({'fighter_id': 'int64'})
+
+
+def replay(fights_df: pd.DataFrame, k_factor=None, chronological=False):
+    # returns ({variation: raw results frame}, final ratings frame), k_factor overrides every variant's
+    variants = VARIANTS
+    if k_factor is not None:
+        variants = {name: {**variant, 'k_factor': k_factor} for name, variant in VARIANTS.items()}
+
+    fights_df = fights_df.copy()
+    fights_df['winner_id'] = parse_fighter_ids(fights_df['winner_id'])
+    fights_df['loser_id'] = parse_fighter_ids(fights_df['loser_id'])
+    fights_df = fights_df[fights_df['winner_id'].notnull() & fights_df['loser_id'].notnull()]
+    fights_df = fights_df.astype({'winner_id': 'int64', 'loser_id': 'int64'})
+
+    # applied order, or chronological with ties in the order the fights were stored in
+    fights_df['event_date'] = pd.to_datetime(fights_df['event_date'])
+    fights_df = fights_df.sort_values(['event_date', 'id'] if chronological else 'id', kind='mergesort')
+
+    _, winner_idx, loser_idx, fighter_ids = index_fighters(
+        [], fights_df['winner_id'], fights_df['loser_id']
+    )
+    ratings = initial_ratings(len(fighter_ids), [], [], variants)
+    peaks = initial_peaks(ratings, [], [], [], [])
+    best_wins = initial_best_wins(len(fighter_ids), [], [], [], len(variants))
+
+    is_ko_or_sub = fights_df['dom'].isin(['ko', 'sub']).to_numpy()
+    is_round_one = (fights_df['round'].astype(str) == '1').to_numpy()
+
+    # rated in event-card batches, same ratings as the fight by fight loop over this order
+    elo_columns = run_fights_batched(winner_idx, loser_idx, k_factors(is_ko_or_sub, is_round_one, variants), ratings)
+    result_frames = build_result_frames(fights_df, elo_columns, variants)
+
+    fight_days = to_days(fights_df['event_date'])
+    update_peaks(peaks, winner_idx, loser_idx, fight_days, elo_columns)
+    update_best_wins(best_wins, winner_idx, loser_idx, fights_df['loser_name'].to_numpy(), fight_days, elo_columns)
+    last_fights = last_fight_days(len(fighter_ids), [], [], winner_idx, loser_idx, fight_days)
+
+    ratings_df = pd.concat([
+        pd.DataFrame(ratings, columns=[variant['current_column'] for variant in variants.values()]),
+        peak_frame(peaks, variants),
+        best_win_frame(best_wins, variants),
+    ], axis=1)
+    ratings_df.insert(0, 'fighter_id', fighter_ids)
+    ratings_df['last_fight_date'] = day_strings(last_fights)
+    return result_frames, ratings_df
+
+
+def compare_ratings(replayed_df: pd.DataFrame, stored_df: pd.DataFrame, tolerance=0.01) -> pd.DataFrame:
+    # fighters whose stored rating differs from the replayed one (or who are missing on either side).
+    # Stored fighters without any raw fight were never rated and count as being at the initial rating
+    merged = replayed_df.merge(stored_df, on='fighter_id', how='outer', suffixes=('_replay', '_stored'),
+                               indicator=True)
+    unrated = (merged['_merge'] == 'right_only').to_numpy()
+    mismatch = np.zeros(len(merged), dtype=bool)
+    for variant in VARIANTS.values():
+        col = variant['current_column']
+        replayed = pd.to_numeric(merged[f'{col}_replay'], errors='coerce')
+        replayed[unrated] = variant['initial']
+        stored = pd.to_numeric(merged[f'{col}_stored'], errors='coerce')
+        mismatch |= ((replayed - stored).abs() > tolerance).to_numpy()
+        mismatch |= (replayed.isnull() != stored.isnull()).to_numpy()
+    return merged[mismatch]
+
+
+def last_id(client, table):
+    data = client.table(table).select('id').order('id', desc=True).limit(1).execute().data
+    return data[0]['id'] if data else 0
+
+
+def write_replay(client, result_frames, ratings_df: pd.DataFrame):
+    # the replayed rows are inserted next to the old ones, which are only deleted once every insert
+    # went through. A failed insert (batch_insert exits) removes the new rows again, the old history stays
+    old_last = {variant['raw_table']: last_id(client, variant['raw_table']) for variant in VARIANTS.values()}
+    try:
+        for variation, variant in VARIANTS.items():
+            data = result_frames[variation].drop(columns=['id'], errors='ignore').to_dict(orient='records')
+            batch_insert(client, variant['raw_table'], data, batch_size=10000)
+    except BaseException:
+        for table, table_last in old_last.items():
+            client.table(table).delete().gt('id', table_last).execute()
+        raise
+    for table, table_last in old_last.items():
+        client.table(table).delete().lte('id', table_last).execute()
+
+    write_fighter_updates(client, ratings_df)
+
+
+def write_fighter_updates(client, updates_df: pd.DataFrame):
+    # only fighters whose values changed are written back
+    fetched_df = read_table(client, 'fighters_enriched_new', '*', key='fighter_id')
+    fetched_df = fetched_df.drop(columns=['id', 'updated_at'], errors='ignore')
+    fetched_df['fighter_id'] = parse_fighter_ids(fetched_df['fighter_id'])
+    fetched_df = fetched_df[fetched_df['fighter_id'].notnull()].astype({'fighter_id': 'int64'})
+
+    enriched_df = fetched_df.set_index('fighter_id')
+    enriched_df.update(updates_df.set_index('fighter_id'))
+    enriched_df = enriched_df.reset_index()
+
+    changed_df = diff_rows(fetched_df, enriched_df, 'fighter_id').copy()
+    changed_df['fighter_id'] = changed_df['fighter_id'].astype('int64')
+    changed_df = changed_df.replace({np.nan: None})
+    batch_upsert(client, 'fighters_enriched_new', changed_df.to_dict(orient='records'),
+                 on_conflict='fighter_id', batch_size=10000)
+    # ranks follow the written ratings
+    write_ranks(client, rank_fighters(enriched_df), read_ranks(client))
+    # calculate_elo.py's local snapshot no longer matches the table
+    discard_snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the full fight history and rebuild all ratings.")
+    parser.add_argument('--k-factor', type=float, default=None,
+                        help="override the K-factor of every variant")
+    parser.add_argument('--chronological', action='store_true',
+                        help="rate in event date order instead of the order the fights were applied")
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    parser.add_argument('--write', action='store_true',
+                        help="replace the raw tables and stored ratings with the replayed ones")
+    parser.add_argument('--rebuild-best-wins', action='store_true',
+                        help="only recompute best_win/best_win_dom from the raw tables and write them")
+    args = parser.parse_args()
+
+    supabase = get_client()
+
+    if args.rebuild_best_wins:
+        start = time.perf_counter()
+        best_wins_df = best_wins_from_raw(load_raw_results(supabase))
+        print(f"Rebuilt best wins of {len(best_wins_df)} fighters in {time.perf_counter() - start:.2f}s.")
+        write_fighter_updates(supabase, best_wins_df)
+        return
+
+    fights_df = load_raw_fights(supabase)
+
+    start = time.perf_counter()
+    result_frames, ratings_df = replay(fights_df, k_factor=args.k_factor, chronological=args.chronological)
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {len(result_frames['normal'])} fights for {len(ratings_df)} fighters in {elapsed:.2f}s.")
+
+    if args.write:
+        write_replay(supabase, result_frames, ratings_df)
+        return
+
+    mismatches = compare_ratings(ratings_df, load_current_ratings(supabase), tolerance=args.tolerance)
+    if mismatches.empty:
+        print("Replayed ratings match fighters_enriched_new.")
+    else:
+        print(f"{len(mismatches)} fighters differ from the replayed ratings:")
+        print(mismatches.head(20))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import heapq
+import os
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from tqdm import tqdm
+
+from db_utils import read_table
+from event_parser import parse_event_page
+from fetcher import fetch_pages
+from get_fights import FETCH_WORKERS, REQUESTS_PER_SECOND, headers, upsert_fights
+from http_client import get_http_client
+from page_cache import TTL_FINAL, TTL_YET_TO_COME, page_cache_from_env
+from storage import get_client
+
+# Event pages get_fights.py found without results (yet_to_come) or without a usable card
+# (empty_event_pages) are checked again on a backoff schedule, since get_links.py has already moved
+# the marker past them. Every link has a next_check: the first re-check comes after first_interval,
+# each further one waits twice as long up to max_interval, so recent events are looked at often and
+# stale ones rarely. A run takes the due links from a priority queue (most overdue first, at most
+# REPOLL_MAX_EVENTS), fetches them conditionally through the page cache (an unchanged page is a 304)
+# and hands the events that have become final to the fight parser and Elo stage.
+# Links still not final after REPOLL_GIVE_UP_DAYS are dropped.
+
+REPOLL_TABLES = {
+    'yet_to_come': {'first_interval': timedelta(hours=12), 'max_interval': timedelta(days=28)},
+    'empty_event_pages': {'first_interval': timedelta(days=2), 'max_interval': timedelta(days=56)},
+}
+REPOLL_MAX_EVENTS = int(os.environ.get('REPOLL_MAX_EVENTS', 200))
+REPOLL_GIVE_UP_DAYS = int(os.environ.get('REPOLL_GIVE_UP_DAYS', 365))
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'  # utc, compares as text
+
+
+def _text(value):
+    return None if value is None or pd.isnull(value) else str(value)
+
+
+def load_queue(client):
+    # heap of (next_check, first_seen, link, table, attempts), one entry per link. Links without
+    # next_check (just written by get_fights, or from before the schedule) sort first
+    queue = []
+    seen = set()
+    for table in REPOLL_TABLES:
+        rows = read_table(client, table, 'link, first_seen, next_check, attempts', key='id')
+        if rows.empty:
+            continue
+        for link, first_seen, next_check, attempts in zip(
+            rows['link'], rows['first_seen'], rows['next_check'], rows['attempts']
+        ):
+            if _text(link) is None or link in seen:
+                continue
+            seen.add(link)
+            attempts = 0 if pd.isnull(attempts) else int(attempts)
+            queue.append((_text(next_check) or '', _text(first_seen) or '', link, table, attempts))
+    heapq.heapify(queue)
+    return queue
+
+
+def due_links(queue, now, max_events=REPOLL_MAX_EVENTS):
+    # (due entries, expired entries) popped off the queue, most overdue first
+    now_text = now.strftime(TIME_FORMAT)
+    give_up = (now - timedelta(days=REPOLL_GIVE_UP_DAYS)).strftime(TIME_FORMAT)
+    due, expired = [], []
+    while queue and queue[0][0] <= now_text and len(due) < max_events:
+        entry = heapq.heappop(queue)
+        if entry[1] and entry[1] < give_up:
+            expired.append(entry)
+        else:
+            due.append(entry)
+    return due, expired
+
+
+def next_check(table, attempts, now):
+    policy = REPOLL_TABLES[table]
+    interval = min(policy['first_interval'] * 2 ** attempts, policy['max_interval'])
+    return (now + interval).strftime(TIME_FORMAT)
+
+
+def repoll_events(client, now=None, max_events=REPOLL_MAX_EVENTS):
+    # checks the due links, returns (fights of the events that are final now, their links). The links
+    # stay queued until drop_links is called once the fights are stored or rated
+    now = now or datetime.now(timezone.utc)
+    due, expired = due_links(load_queue(client), now, max_events)
+    if expired:
+        print(f"Giving up on {len(expired)} event pages older than {REPOLL_GIVE_UP_DAYS} days")
+        drop_links(client, [(link, table) for _, _, link, table, _ in expired])
+    if not due:
+        print("No event pages due for a re-check")
+        return [], []
+
+    # local page cache, PAGE_CACHE=0 disables it
+    page_cache = page_cache_from_env()
+    entries = {link: (table, attempts) for _, _, link, table, attempts in due}
+    pages = fetch_pages(list(entries), headers=headers, max_workers=FETCH_WORKERS,
+                        requests_per_second=REQUESTS_PER_SECOND, cache=page_cache, ttl=TTL_YET_TO_COME)
+
+    fights, final_links = [], []
+    not_modified = 0
+    checked = now.strftime(TIME_FORMAT)
+    for link, response, error in tqdm(pages, total=len(entries)):
+        table, attempts = entries[link]
+        status = 'empty'
+        if error is not None:
+            print(f"Error re-checking {link}: {error}")
+        elif response.status_code == 200:
+            not_modified += getattr(response, 'from_cache', False)
+            status, event_fights = parse_event_page(response.text, link)
+
+        if status == 'fights':
+            fights.extend(event_fights)
+            final_links.append((link, table))
+            if page_cache:
+                page_cache.set_ttl(link, TTL_FINAL)
+        else:
+            client.table(table).update({
+                'last_checked': checked, 'next_check': next_check(table, attempts, now), 'attempts': attempts + 1,
+            }).eq('link', link).execute()
+
+    print(f"Re-checked {len(entries)} event pages ({not_modified} unchanged or cached): "
+          f"{len(final_links)} now final with {len(fights)} fights")
+    return fights, final_links
+
+
+def drop_links(client, links):
+    # (link, table) pairs leave the queue, all rows of a link at once
+    for link, table in links:
+        client.table(table).delete().eq('link', link).execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-check yet_to_come and empty event pages for late results.")
+    parser.add_argument('--max-events', type=int, default=REPOLL_MAX_EVENTS,
+                        help="event pages to re-check at most in this run")
+    args = parser.parse_args()
+
+    supabase = get_client()
+    fights, final_links = repoll_events(supabase, max_events=args.max_events)
+    if fights:
+        # calculate_elo.py rates them with the next batch from mma_fight_results
+        upsert_fights(supabase, fights)
+    drop_links(supabase, final_links)
+    get_http_client().print_stats()
+
+
+if __name__ == "__main__":
+    main()
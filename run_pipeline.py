@@ -0,0 +1,77 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import get_client
+from get_links import collect_event_links, save_latest_event, write_event_links
+from get_fights import CrawlCheckpoint, crawl_fights, upsert_fights
+from calculate_elo import load_new_fights, update_ratings
+from scrape_ufc_ranks import update_ufc_ranks
+from http_client import get_http_client
+from repoll_events import drop_links, repoll_events
+
+# Runs get_links -> get_fights -> calculate_elo in one process with one client. Event links are
+# handed to the crawl in memory instead of going through the event_links table, PERSIST_INTERMEDIATE=1
+# still writes them so get_fights.py can be rerun on its own. The crawl streams the fights into
+# mma_fight_results every few events with its checkpoint, as get_fights.py does, so an interrupted
+# run resumes after the last flush; the ratings then take every fight not rated yet from there.
+# The UFC rankings scrape is independent and runs in a background thread.
+#
+# Events that were yet to come or empty in earlier runs are re-checked first (repoll_events.py),
+# the ones that have become final are rated together with the new events.
+#
+# The latest event is only saved to initial_variables once the ratings are written, so a
+# failed run scrapes the same events again next time; re-checked events stay queued until then.
+
+PERSIST_INTERMEDIATE = os.environ.get('PERSIST_INTERMEDIATE') == '1'
+
+
+def timed(timings, stage, func, *args):
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        timings[stage] = time.perf_counter() - start
+        print(f"[{stage}] {timings[stage]:.1f}s")
+
+
+def main():
+    supabase = get_client()
+    timings = {}
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        ranks = pool.submit(timed, timings, 'scrape_ufc_ranks', update_ufc_ranks, supabase)
+
+        event_links, latest_event = timed(timings, 'get_links', collect_event_links, supabase)
+        late_fights, final_links = timed(timings, 'repoll_events', repoll_events, supabase)
+
+        if late_fights:
+            upsert_fights(supabase, late_fights)
+        if event_links:
+            if PERSIST_INTERMEDIATE:
+                write_event_links(supabase, event_links)
+
+            timed(timings, 'get_fights', crawl_fights, supabase, event_links, CrawlCheckpoint())
+        else:
+            print("No new events found")
+
+        # a rerun after a failed run scrapes the same events, their fights are only rated once
+        new_fights_df = timed(timings, 'load_fights', load_new_fights, supabase)
+        if len(new_fights_df):
+            timed(timings, 'calculate_elo', update_ratings, supabase, new_fights_df)
+        else:
+            print("No new fights found")
+
+        drop_links(supabase, final_links)
+        save_latest_event(supabase, latest_event)
+        ranks.result()
+
+    print("\n--- Stage wall time ---")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<18} {seconds:8.1f}s")
+    get_http_client().print_stats()
+    print("Run Finished")
+
+
+if __name__ == "__main__":
+    main()
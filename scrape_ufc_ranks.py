@@ -1,20 +1,20 @@
-import requests
 from bs4 import BeautifulSoup
 import pandas as pd
-import os
-import sys
-from supabase import create_client, Client
+from storage import get_client
+from http_client import get_http_client, http_get
 
 
-SUPABASE_URL = os.environ.get('SUPABASE_URL')
-SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 def scrape_ufc_rankings(url: str) -> pd.DataFrame:
-    response = requests.get(url)
+    response = http_get(url)
     response.raise_for_status()  
 
-    soup = BeautifulSoup(response.text, "html.parser")
+    df = parse_ufc_rankings(response.text)
+    print(df)
+    return df
+
+
+def parse_ufc_rankings(html: str) -> pd.DataFrame:
+    soup = BeautifulSoup(html, "html.parser")
     
     view_groupings = soup.find_all("div", class_="view-grouping")
     
@@ -68,19 +68,22 @@ def scrape_ufc_rankings(url: str) -> pd.DataFrame:
     df = pd.DataFrame(data, columns=["rank", "weightclass", "name"])
     # # df.to_csv('test.csv', index = False)
     df["rank"] = df["rank"].fillna("NaN")
-    print(df)
     return df
 
 
 
-def main():
-    url = "https://www.ufc.com/rankings"
-
+def update_ufc_ranks(supabase, url="https://www.ufc.com/rankings"):
     df_rankings = scrape_ufc_rankings(url)
     supabase.table("ufc_ranks").delete().neq("rank", -9999).execute()
     data_to_insert = df_rankings.to_dict(orient="records")
     response = supabase.table("ufc_ranks").insert(data_to_insert).execute()
     print("Insert response:", response)
 
+
+def main():
+    supabase = get_client()
+    update_ufc_ranks(supabase)
+    get_http_client().print_stats()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,170 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Building blocks to run fetch -> parse -> write as overlapping stages instead of one after the other:
+#
+#   pages = fetch_pages(links, ...)                                  # network, thread pool
+#   parsed = parse_in_pool(((link, (html, link)) ...), parse_event_page, stats=parse_stats)
+#   with BackgroundWriter(stats=write_stats) as writer:              # database, one thread
+#       for link, result in parsed:
+#           writer.submit(write_batch, rows)
+#
+# Every stage holds a bounded number of items (fetch_pages 2 * its workers, the parse pool
+# 2 * PARSE_WORKERS, the writer WRITE_QUEUE_SIZE jobs), a full stage blocks the one before it,
+# so memory stays flat however many pages go through. StageStats collects items, busy time and
+# queue depth per stage for print_stage_stats.
+
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', 4))
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.depth_total = 0
+        self.depth_samples = 0
+        self.max_depth = 0
+        self.lock = threading.Lock()
+
+    def record(self, items=1, seconds=0.0, depth=None):
+        with self.lock:
+            self.items += items
+            self.busy_seconds += seconds
+            if depth is not None:
+                self.depth_total += depth
+                self.depth_samples += 1
+                self.max_depth = max(self.max_depth, depth)
+
+
+def print_stage_stats(stats, elapsed):
+    # throughput over the wall time of the whole run, busy time adds up across a stage's workers
+    print(f"\n--- Stages ({elapsed:.1f}s wall) ---")
+    for stage in stats:
+        depth = stage.depth_total / stage.depth_samples if stage.depth_samples else 0.0
+        print(f"  {stage.name:<8} {stage.items:8d} items {stage.items / max(elapsed, 1e-9):8.1f}/s "
+              f"busy {stage.busy_seconds:7.1f}s queue avg {depth:5.1f} max {stage.max_depth:3d}")
+
+
+def counted(items, stats):
+    # passes items through, recording each one and the time spent waiting for it (the stage
+    # before a pool or writer, e.g. the fetcher)
+    item_iter = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(item_iter)
+        except StopIteration:
+            return
+        stats.record(seconds=time.perf_counter() - start)
+        yield item
+
+
+def _run(func, args):
+    # worker side: the result or the exception, and the time it took
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - start
+
+
+def parse_in_pool(items, func, workers=PARSE_WORKERS, stats=None):
+    # items are (key, args) pairs, args None to pass an item through untouched. Yields
+    # (key, result) in input order, result being func(*args), the exception it raised, or None.
+    # func runs on a process pool (it has to be a module level function) with at most 2 * workers
+    # calls in flight; the next item is only taken from items once one is consumed
+    stats = stats or StageStats('parse')
+    if workers <= 1:
+        for key, args in items:
+            if args is None:
+                yield key, None
+                continue
+            result, seconds = _run(func, args)
+            stats.record(seconds=seconds)
+            yield key, result
+        return
+
+    # spawned workers, forking next to the fetcher's threads could copy a held lock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = deque()
+        item_iter = iter(items)
+
+        def submit_next():
+            for key, args in item_iter:
+                pending.append((key, None if args is None else pool.submit(_run, func, args)))
+                return True
+            return False
+
+        while len(pending) < 2 * workers and submit_next():
+            pass
+        while pending:
+            key, future = pending.popleft()
+            submit_next()
+            if future is None:
+                yield key, None
+                continue
+            result, seconds = future.result()
+            stats.record(seconds=seconds, depth=len(pending))
+            yield key, result
+
+
+class BackgroundWriter:
+    # runs write jobs one at a time in submission order on a thread of its own. submit blocks while
+    # max_queue jobs are waiting, which holds back the producer. After a failed job the rest are
+    # skipped, the error (SystemExit from batch writes included) is raised from submit or close
+    def __init__(self, max_queue=WRITE_QUEUE_SIZE, stats=None):
+        self.stats = stats or StageStats('write')
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            func, args, items = job
+            if self.error is not None:
+                continue
+            start = time.perf_counter()
+            try:
+                func(*args)
+            except BaseException as e:
+                self.error = e
+            self.stats.record(items=items, seconds=time.perf_counter() - start)
+
+    def _raise(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, func, *args, items=1):
+        self._raise()
+        self.stats.record(items=0, depth=self.jobs.qsize())
+        self.jobs.put((func, args, items))
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # already failing, stop after the job at hand
+            self.error = self.error or exc
+            self.jobs.put(None)
+            self.thread.join()
+        return False
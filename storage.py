@@ -0,0 +1,269 @@
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+# Storage backends. Every script talks to the database through the subset of the
+# supabase-py query builder below, so a backend only has to provide
+#
+#   client.table(name)
+#       .select(columns, count=None) / .insert(rows) / .upsert(rows, on_conflict=...)
+#       .update(values) / .delete()
+#       .eq() .neq() .gt() .gte() .lt() .lte() .in_() .is_()  .order() .range() .limit()
+#       .execute()  -> response with .data (list of dicts) and .count
+#
+# STORAGE_BACKEND=supabase (default) returns the real Supabase client,
+# STORAGE_BACKEND=sqlite a local stand-in with the same tables in SQLITE_PATH.
+
+# column name -> sqlite type, 'id' is always the autoincrement primary key. updated_at columns are
+# set on every write, by default on insert and by a trigger on update
+NOW_SQL = "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+TABLES = {
+    'initial_variables': {
+        'month': 'TEXT', 'day': 'TEXT', 'year': 'TEXT', 'name': 'TEXT',
+    },
+    'event_links': {
+        'link': 'TEXT',
+    },
+    'mma_fight_results': {
+        'winner_id': 'TEXT', 'winner_name': 'TEXT', 'final_result': 'TEXT',
+        'loser_name': 'TEXT', 'loser_id': 'TEXT', 'event_name': 'TEXT',
+        'event_date': 'TEXT', 'winby': 'TEXT', 'referee': 'TEXT', 'round': 'TEXT',
+        'fight_key': 'TEXT UNIQUE', 'rated_at': 'TEXT',
+    },
+    'fighters_enriched_new': {
+        'fighter_id': 'INTEGER UNIQUE', 'name': 'TEXT',
+        'peak_elo': 'REAL', 'peak_elo_dom': 'REAL', 'peak_date': 'TEXT', 'peak_date_dom': 'TEXT',
+        'current_elo': 'REAL', 'current_elo_dom': 'REAL',
+        'days_peak': 'REAL', 'days_peak_dom': 'REAL', 'last_fight_date': 'TEXT',
+        'best_win': 'TEXT', 'best_win_dom': 'TEXT', 'best_win_elo': 'REAL', 'best_win_elo_dom': 'REAL',
+        'nickname': 'TEXT', 'nationality': 'TEXT',
+        'birthplace': 'TEXT', 'age': 'TEXT', 'birth_date': 'TEXT', 'height': 'TEXT',
+        'weight': 'TEXT', 'association': 'TEXT', 'weight_class': 'TEXT',
+        'updated_at': f'TEXT DEFAULT ({NOW_SQL})',
+    },
+    'yet_to_come': {
+        'link': 'TEXT', 'first_seen': 'TEXT', 'last_checked': 'TEXT', 'next_check': 'TEXT', 'attempts': 'INTEGER',
+    },
+    'empty_event_pages': {
+        'link': 'TEXT', 'first_seen': 'TEXT', 'last_checked': 'TEXT', 'next_check': 'TEXT', 'attempts': 'INTEGER',
+    },
+    'fighter_ranks': {
+        'fighter_id': 'INTEGER UNIQUE', 'rank_elo': 'INTEGER', 'rank_elo_dom': 'INTEGER',
+        'class_rank_elo': 'INTEGER', 'class_rank_elo_dom': 'INTEGER',
+    },
+    'ufc_ranks': {
+        'rank': 'TEXT', 'weightclass': 'TEXT', 'name': 'TEXT',
+    },
+}
+
+RAW_COLUMNS = {
+    'winner_id': 'TEXT', 'winner_name': 'TEXT', 'loser_id': 'TEXT', 'loser_name': 'TEXT',
+    'event_name': 'TEXT', 'event_date': 'TEXT', 'winby': 'TEXT', 'referee': 'TEXT',
+    'round': 'TEXT', 'dom': 'TEXT',
+    'winner_elo_before': 'REAL', 'winner_elo_after': 'REAL',
+    'loser_elo_before': 'REAL', 'loser_elo_after': 'REAL', 'fight_key': 'TEXT',
+}
+# new fighters are logged with the same fields they get in fighters_enriched_new
+TABLES['new_fighters'] = {
+    **{col: sql_type for col, sql_type in TABLES['fighters_enriched_new'].items() if col != 'updated_at'},
+    'fighter_id': 'TEXT',
+}
+TABLES['fighters_regular_raw'] = RAW_COLUMNS
+TABLES['fighters_dom_raw'] = RAW_COLUMNS
+
+# numpy scalars end up in records built from DataFrames
+for _np_type, _py_type in [(np.int64, int), (np.int32, int), (np.float64, float), (np.float32, float), (np.bool_, bool)]:
+    sqlite3.register_adapter(_np_type, _py_type)
+
+
+class Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class SQLiteQuery:
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+        self.action = 'select'
+        self.columns = '*'
+        self.count = None
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []
+        self.params = []
+        self.order_by = []
+        self.limit_count = None
+        self.offset = None
+
+    # actions
+    def select(self, *columns, count=None):
+        self.action = 'select'
+        self.columns = ','.join(columns) if columns else '*'
+        self.count = count
+        return self
+
+    def insert(self, data):
+        self.action = 'insert'
+        self.payload = data if isinstance(data, list) else [data]
+        return self
+
+    def upsert(self, data, on_conflict=''):
+        self.action = 'upsert'
+        self.payload = data if isinstance(data, list) else [data]
+        self.on_conflict = on_conflict
+        return self
+
+    def update(self, data):
+        self.action = 'update'
+        self.payload = data
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    # filters
+    def _filter(self, column, op, value):
+        self.filters.append(f'"{column}" {op} ?')
+        self.params.append(value)
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, '=', value)
+
+    def neq(self, column, value):
+        return self._filter(column, '<>', value)
+
+    def gt(self, column, value):
+        return self._filter(column, '>', value)
+
+    def gte(self, column, value):
+        return self._filter(column, '>=', value)
+
+    def lt(self, column, value):
+        return self._filter(column, '<', value)
+
+    def lte(self, column, value):
+        return self._filter(column, '<=', value)
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self.filters.append('0')
+            return self
+        self.filters.append(f'"{column}" IN ({", ".join("?" * len(values))})')
+        self.params.extend(values)
+        return self
+
+    def is_(self, column, value):
+        # only is_(column, 'null') is used
+        if value != 'null':
+            raise ValueError(f"Unsupported is_ value {value!r}, expected 'null'.")
+        self.filters.append(f'"{column}" IS NULL')
+        return self
+
+    # modifiers
+    def order(self, column, desc=False):
+        self.order_by.append(f'"{column}" {"DESC" if desc else "ASC"}')
+        return self
+
+    def range(self, start, end):
+        self.offset = start
+        self.limit_count = end - start + 1
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def _where(self):
+        return f' WHERE {" AND ".join(self.filters)}' if self.filters else ''
+
+    def execute(self):
+        with self.client.lock:
+            return getattr(self, f'_execute_{self.action}')(self.client.db)
+
+    def _execute_select(self, db):
+        columns = [col.strip() for col in self.columns.split(',') if col.strip()]
+        column_sql = '*' if columns == ['*'] else ', '.join(f'"{col}"' for col in columns)
+        sql = f'SELECT {column_sql} FROM "{self.table_name}"{self._where()}'
+        if self.order_by:
+            sql += f' ORDER BY {", ".join(self.order_by)}'
+        if self.limit_count is not None or self.offset is not None:
+            sql += f' LIMIT {self.limit_count if self.limit_count is not None else -1} OFFSET {self.offset or 0}'
+        cursor = db.execute(sql, self.params)
+        names = [d[0] for d in cursor.description]
+        data = [dict(zip(names, row)) for row in cursor.fetchall()]
+
+        count = None
+        if self.count:
+            count = db.execute(f'SELECT COUNT(*) FROM "{self.table_name}"{self._where()}', self.params).fetchone()[0]
+        return Response(data, count)
+
+    def _write_rows(self, db, conflict_sql=''):
+        if not self.payload:
+            return Response([])
+        columns = list(dict.fromkeys(col for row in self.payload for col in row))
+        column_sql = ', '.join(f'"{col}"' for col in columns)
+        sql = (f'INSERT INTO "{self.table_name}" ({column_sql}) '
+               f'VALUES ({", ".join("?" * len(columns))}){conflict_sql}')
+        with db:
+            db.executemany(sql, [[row.get(col) for col in columns] for row in self.payload])
+        return Response(self.payload)
+
+    def _execute_insert(self, db):
+        return self._write_rows(db)
+
+    def _execute_upsert(self, db):
+        columns = list(dict.fromkeys(col for row in self.payload for col in row))
+        keys = [key.strip() for key in (self.on_conflict or 'id').split(',')]
+        updates = ', '.join(f'"{col}" = excluded."{col}"' for col in columns if col not in keys)
+        conflict_sql = f' ON CONFLICT ({", ".join(keys)}) DO ' + (f'UPDATE SET {updates}' if updates else 'NOTHING')
+        return self._write_rows(db, conflict_sql)
+
+    def _execute_update(self, db):
+        assignments = ', '.join(f'"{col}" = ?' for col in self.payload)
+        with db:
+            db.execute(f'UPDATE "{self.table_name}" SET {assignments}{self._where()}',
+                       list(self.payload.values()) + self.params)
+        return Response([])
+
+    def _execute_delete(self, db):
+        with db:
+            db.execute(f'DELETE FROM "{self.table_name}"{self._where()}', self.params)
+        return Response([])
+
+
+class SQLiteClient:
+    # local stand-in for the Supabase client, creates the pipeline's tables on first use
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        for table_name, columns in TABLES.items():
+            column_sql = ', '.join(f'"{col}" {sql_type}' for col, sql_type in columns.items())
+            self.db.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table_name}" (id INTEGER PRIMARY KEY AUTOINCREMENT, {column_sql})'
+            )
+            if 'updated_at' in columns:
+                self.db.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS "{table_name}_updated_at" AFTER UPDATE ON "{table_name}" '
+                    f'BEGIN UPDATE "{table_name}" SET updated_at = {NOW_SQL} WHERE id = NEW.id; END'
+                )
+        self.db.commit()
+
+    def table(self, table_name):
+        return SQLiteQuery(self, table_name)
+
+
+def get_client(backend=None):
+    backend = backend or os.environ.get('STORAGE_BACKEND', 'supabase')
+    if backend == 'sqlite':
+        return SQLiteClient(os.environ.get('SQLITE_PATH', 'local.sqlite'))
+    if backend == 'supabase':
+        from supabase import create_client
+        return create_client(os.environ.get('SUPABASE_URL'), os.environ.get('SUPABASE_KEY'))
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}', expected 'supabase' or 'sqlite'.")